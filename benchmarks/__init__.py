@@ -0,0 +1,31 @@
+"""
+Scripts that measure the server's hot paths, kept out of the modules they
+measure. Run them from the repository root, e.g.
+
+    python -m benchmarks.pooling
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from storage import ConnectionPool
+
+
+@contextmanager
+def scratch_pool(threads, **kwargs):
+    """
+    Yield a `ConnectionPool` on a new database in a temporary directory, and
+    an executor of `threads` threads to use it from. The calling thread may
+    use the pool too. `kwargs` are passed on to `ConnectionPool`.
+    """
+    with TemporaryDirectory() as root:
+        pool = ConnectionPool(join(root, "benchmark.sqlite3"), threads + 1, **kwargs)
+        executor = ThreadPoolExecutor(max_workers=threads)
+        try:
+            yield pool, executor
+            asyncio.run(pool.close_all(executor, threads))
+        finally:
+            executor.shutdown()
@@ -0,0 +1,56 @@
+"""
+Broadcasting one message to many connections, encoding it once for all of
+them as `Game.broadcast` does, and again for each connection.
+
+    python -m benchmarks.broadcast
+"""
+
+import asyncio
+from json import dumps
+from time import perf_counter
+
+from connections import GameConnections, SendQueue
+from game import Game
+
+
+def benchmark(sizes=(1, 10, 100, 1000), broadcasts=200):
+    """
+    Time broadcasting one message to each of `sizes` connections.
+
+    Returns `{size: (shared, each)}` in seconds per broadcast: `shared` is
+    `Game.broadcast`, which encodes the message once for every connection,
+    and `each` encodes it again for every connection, as was done before.
+    """
+    players = [f"player{i}" for i in range(10)]
+    message = {
+        "kind": "nomination_vote_results",
+        "results": {player: i % 3 != 0 for i, player in enumerate(players)},
+        "approved": True,
+        "vote_track": 2,
+        "mission": players[:4],
+    }
+
+    async def measure(size):
+        connections = GameConnections()
+        for i in range(size):
+            connections.add(SendQueue(maxsize=0), f"user{i}")  # unbounded
+        game = Game(connections)
+        started = perf_counter()
+        for _ in range(broadcasts):
+            await game.broadcast(message)
+        shared = perf_counter() - started
+
+        started = perf_counter()
+        for seq in range(broadcasts):
+            for queue, _ in connections:
+                queue.offer(dumps(dict(message, seq=seq)))
+        each = perf_counter() - started
+        return shared / broadcasts, each / broadcasts
+
+    return {size: asyncio.run(measure(size)) for size in sizes}
+
+
+if __name__ == "__main__":
+    print("connections   shared frame   encoded for each")
+    for size, (shared, each) in benchmark().items():
+        print(f"{size:11} {shared * 1e6:11.1f} µs {each * 1e6:15.1f} µs")
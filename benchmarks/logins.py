@@ -0,0 +1,67 @@
+"""
+Many logins at once, hashing inline on the event loop and on a `HashPool`,
+and how late the event loop runs meanwhile.
+
+    python -m benchmarks.logins
+"""
+
+import asyncio
+from time import perf_counter
+
+from crypt import HashPool, gen_salt, hash_password
+
+
+def benchmark(logins=32, interval=0.005):
+    """
+    Hash `logins` passwords at once, inline on the event loop as before and
+    on a `HashPool`, returning `{way: (seconds, worst lag)}`.
+
+    The lag is how late a task that wakes every `interval` seconds runs: how
+    long a websocket message would wait to be handled during the logins.
+    """
+    salt = gen_salt()
+    pool = HashPool(max_pending=logins)
+
+    async def measure(hash_all):
+        lags = []
+        finished = False
+
+        async def tick():
+            while not finished:
+                due = perf_counter() + interval
+                await asyncio.sleep(interval)
+                lags.append(perf_counter() - due)
+
+        ticker = asyncio.ensure_future(tick())
+        await asyncio.sleep(interval * 4)
+        started = perf_counter()
+        await hash_all()
+        elapsed = perf_counter() - started
+        finished = True
+        await ticker
+        return elapsed, max(lags)
+
+    async def inline():
+        for i in range(logins):
+            hash_password(f"password{i}", salt)
+
+    async def pooled():
+        await asyncio.gather(
+            *(pool.hash_password(f"password{i}", salt) for i in range(logins))
+        )
+
+    try:
+        asyncio.run(pool.hash_password("warm up", salt))  # start the workers
+        return {
+            "inline": asyncio.run(measure(inline)),
+            "HashPool": asyncio.run(measure(pooled)),
+        }
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    logins = 32
+    print(f"{logins} logins at once:")
+    for way, (seconds, lag) in benchmark(logins).items():
+        print(f"{way:9} {seconds:6.2f} s, event loop up to {lag * 1000:7.1f} ms late")
@@ -0,0 +1,50 @@
+"""
+The cost of each kind of metric update, against `metrics.BUDGET`. Exits
+non-zero if any is over budget.
+
+    python -m benchmarks.metric_updates
+"""
+
+from time import perf_counter
+
+from metrics import BUDGET, Counter, Histogram, Registry
+
+
+def benchmark(iterations=200000):
+    """Return the cost in seconds of each kind of metric update."""
+    registry = Registry()
+    counter = Counter("bench_total", "", registry=registry)
+    labelled = Counter("bench_labelled", "", ("kind",), registry=registry)
+    histogram = Histogram("bench_seconds", "", registry=registry)
+
+    def timed():
+        started = perf_counter()
+        histogram.observe(perf_counter() - started)
+
+    updates = {
+        "Counter.inc": counter.inc,
+        "Counter.labels().inc": lambda: labelled.labels("x").inc(),
+        "Histogram.observe": lambda: histogram.observe(0.003),
+        "timed observe": timed,
+    }
+    baseline = _per_call(lambda: None, iterations)  # the lambda and loop
+    return {
+        name: max(_per_call(update, iterations) - baseline, 0)
+        for name, update in updates.items()
+    }
+
+
+def _per_call(function, iterations):
+    started = perf_counter()
+    for _ in range(iterations):
+        function()
+    return (perf_counter() - started) / iterations
+
+
+if __name__ == "__main__":
+    over_budget = False
+    for name, cost in benchmark().items():
+        over_budget |= cost > BUDGET
+        print(f"{name:<22} {cost * 1e9:6.0f} ns")
+    print(f"budget: {BUDGET * 1e9:.0f} ns per update")
+    raise SystemExit(1 if over_budget else 0)
@@ -0,0 +1,64 @@
+"""
+Cookie checks and log ins/outs at once, with `storage.PRAGMAS` and with
+SQLite's defaults.
+
+    python -m benchmarks.mixed_load
+"""
+
+from datetime import datetime, timedelta
+from random import Random
+from secrets import token_hex
+from time import perf_counter
+
+from benchmarks import scratch_pool
+from storage import PRAGMAS, Cookies, CursorManager
+
+
+def benchmark(seconds=2.0, readers=3, sessions=10000):
+    """
+    Return `{setting: (reads, writes)}` a second with `PRAGMAS` ("tuned") and
+    with SQLite's defaults, each on a scratch database of `sessions` cookies.
+
+    `readers` threads check random cookies while another logs users in and
+    out, as page loads and websocket connects do alongside logins.
+    """
+    results = dict()
+    for setting, pragmas in (("tuned", PRAGMAS), ("defaults", ())):
+        with scratch_pool(readers + 1, pragmas=pragmas) as (pool, executor):
+            cookies = Cookies(pool)
+            expiration = int((datetime.now() + timedelta(days=1)).timestamp())
+            valid = [token_hex(30) for _ in range(sessions)]
+            with CursorManager(pool) as cursor:
+                cursor.executemany(
+                    "INSERT INTO cookies VALUES (?, 'reader', ?)",
+                    [(cookie, expiration) for cookie in valid],
+                )
+            deadline = perf_counter() + seconds
+
+            def read(seed):
+                choices, done = Random(seed), 0
+                while perf_counter() < deadline:
+                    cookies.check(choices.choice(valid))
+                    done += 1
+                return done
+
+            def write():
+                done = 0
+                while perf_counter() < deadline:
+                    cookies.remove(cookies.new("writer"))
+                    done += 2
+                return done
+
+            reads = [executor.submit(read, seed) for seed in range(readers)]
+            writes = executor.submit(write)
+            results[setting] = (
+                sum(future.result() for future in reads) / seconds,
+                writes.result() / seconds,
+            )
+    return results
+
+
+if __name__ == "__main__":
+    print("cookie checks and log ins/outs at once, 3 readers and 1 writer:")
+    for setting, (reads, writes) in benchmark().items():
+        print(f"{setting:9} {reads:8.0f} reads/s {writes:8.0f} writes/s")
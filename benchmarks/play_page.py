@@ -0,0 +1,54 @@
+"""
+/play/<id>/ requests a second, and bytes sent for each, with `server.PAGES`
+caching the page, with browsers revalidating it by its ETag, and with the
+page rendered every time. Requests go through Quart's test client, so this
+leaves out the network and hypercorn.
+
+    python -m benchmarks.play_page
+"""
+
+import asyncio
+import os
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+
+def benchmark(server, requests=2000):
+    """Return `{way: (requests a second, body bytes)}` for a player's page."""
+
+    async def rate(app, client, cache, headers=None):
+        app.config["PAGE_CACHE"] = cache
+        response = await client.get("/play/1/", headers=headers)  # warm up
+        started = perf_counter()
+        for _ in range(requests):
+            await client.get("/play/1/", headers=headers)
+        return requests / (perf_counter() - started), len(await response.get_data())
+
+    async def run():
+        async with server.app.test_app() as app:
+            client = app.test_client()
+            form = {"username": "benchmark", "password": "password"}
+            await client.post("/sign_up", form=form)
+            await client.post("/log_in", form=form)
+            etag = (await client.get("/play/1/")).headers["ETag"]
+            return {
+                "cached": await rate(server.app, client, True),
+                "revalidated (304)": await rate(
+                    server.app, client, True, {"If-None-Match": etag}
+                ),
+                "rendered every time": await rate(server.app, client, False),
+            }
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    with TemporaryDirectory() as root:
+        # before anything imports storage
+        os.environ["RESISTANCE_DATABASE"] = os.path.join(root, "benchmark.sqlite3")
+        os.environ["RESISTANCE_AVATARS"] = os.path.join(root, "avatars")
+        import server
+
+        print("/play/<id>/ for a logged-in player:")
+        for way, (per_second, sent) in benchmark(server).items():
+            print(f"{way:20} {per_second:7.0f} requests/s {sent:6} bytes")
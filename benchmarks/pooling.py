@@ -0,0 +1,46 @@
+"""
+Cookie checks a second with pooled connections, and with a new connection
+for every cursor, as `CursorManager` used to open.
+
+    python -m benchmarks.pooling
+"""
+
+import sqlite3
+from time import perf_counter
+
+from benchmarks import scratch_pool
+from storage import EXECUTOR_THREADS, ConnectionPool, Cookies
+
+
+class Unpooled(ConnectionPool):
+    """Opens a new connection for every cursor."""
+
+    def connection(self):
+        return sqlite3.connect(self.path)
+
+    def recover(self, conn):
+        conn.close()
+
+
+def benchmark(lookups=10000, threads=EXECUTOR_THREADS):
+    """Return cookie checks a second on `threads` threads, `(pooled, unpooled)`."""
+    with scratch_pool(threads) as (pool, executor):
+        cookies = Cookies(pool)
+        cookie = cookies.new("benchmark")
+
+        def rate(cookies):
+            started = perf_counter()
+            for _ in executor.map(cookies.check, [cookie] * lookups):
+                pass
+            return lookups / (perf_counter() - started)
+
+        pooled = rate(cookies)
+        unpooled = rate(Cookies(Unpooled(pool.path)))
+    return pooled, unpooled
+
+
+if __name__ == "__main__":
+    pooled, unpooled = benchmark()
+    print(f"cookie checks, {EXECUTOR_THREADS} threads:")
+    print(f"pooled connections:       {pooled:8.0f}/s")
+    print(f"a connection per cursor:  {unpooled:8.0f}/s")
@@ -0,0 +1,117 @@
+"""
+Bytes sent (with and without permessage-deflate) and encoding time per game
+with each websocket protocol.
+
+    python -m benchmarks.protocols
+"""
+
+import asyncio
+from random import Random
+from time import perf_counter
+from zlib import Z_SYNC_FLUSH, compressobj
+
+from connections import GameConnections
+from engine import GameStates
+from game import Game
+from protocol import PROTOCOLS, msgpack
+
+
+class Connection:
+    """Stands in for a `connections.SendQueue`, tallying what it's sent."""
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        # permessage-deflate with the default context takeover
+        self.deflate = compressobj(wbits=-15)
+        self.frames = 0
+        self.bytes = 0
+        self.deflated_bytes = 0
+
+    def offer(self, frame):
+        if isinstance(frame, str):
+            frame = frame.encode()
+        self.frames += 1
+        self.bytes += len(frame)
+        compressed = self.deflate.compress(frame) + self.deflate.flush(Z_SYNC_FLUSH)
+        self.deflated_bytes += len(compressed) - 4  # the flush marker isn't sent
+
+
+class Timed:
+    """Wraps a protocol, timing its `encode`."""
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.name = protocol.name
+        self.seconds = 0.0
+
+    def encode(self, message, seats):
+        started = perf_counter()
+        try:
+            return self.protocol.encode(message, seats)
+        finally:
+            self.seconds += perf_counter() - started
+
+
+async def play(protocol, seed, num_players=7, num_spectators=2):
+    """Play one game of random moves; return its connections."""
+    players = tuple(f"player{i}" for i in range(num_players))
+    spectators = tuple(f"spectator{i}" for i in range(num_spectators))
+    connections = GameConnections()
+    for name in players + spectators:
+        connections.add(Connection(protocol), name)
+    game = Game(connections)
+    for name in players:
+        await game.join(name)
+        await game.mark_ready(name)
+    for connection, name in connections:
+        await game.catch_up(name, connection)
+    await game.begin(players, seed)
+
+    async def move(player_id, **move):
+        await game.player_move(player_id, move, None)
+
+    choices = Random(seed)
+    engine = game.engine
+    while game.state != GameStates.GAME_OVER:
+        if game.state == GameStates.NOMINATING:
+            leader = engine.players[engine.mission_leader]
+            mission = choices.sample(players, engine.mission_size())
+            await move(leader, kind="nominate", nomination=mission)
+        elif game.state == GameStates.VOTING_MISSION:
+            for name in players:
+                vote = choices.random() < 0.6
+                await move(name, kind="nomination_vote", vote=vote)
+        else:
+            for name in tuple(engine.mission):
+                vote = name not in engine.spies or choices.random() < 0.5
+                await move(name, kind="mission_vote", vote=vote)
+    return [connection for connection, _ in connections]
+
+
+def benchmark(games=50):
+    """Return `{name: (frames, bytes, deflated bytes, encode seconds)}` per game."""
+    results = dict()
+    for protocol in PROTOCOLS.values():
+        timed = Timed(protocol)
+        totals = [0, 0, 0]
+        for seed in range(games):
+            for connection in asyncio.run(play(timed, seed)):
+                totals[0] += connection.frames
+                totals[1] += connection.bytes
+                totals[2] += connection.deflated_bytes
+        results[protocol.name] = (
+            *(total / games for total in totals),
+            timed.seconds / games,
+        )
+    return results
+
+
+if __name__ == "__main__":
+    if msgpack is None:
+        print("msgpack isn't installed; skipping resistance.msgpack")
+    print("per game (7 players, 2 spectators):")
+    for name, (frames, sent, deflated, seconds) in benchmark().items():
+        print(
+            f"{name:20} {frames:5.0f} frames {sent:8.0f} bytes "
+            f"{deflated:8.0f} deflated {seconds * 1e6:7.0f} µs encoding"
+        )
@@ -0,0 +1,119 @@
+"""
+Simulate many games of bots playing random legal moves against the engine.
+
+Games are split into batches that run across a process pool; each batch
+drives `engine.Engine` directly, with no asyncio or messages. Prints
+win rates per player count, e.g. to check the balance of rule changes.
+
+    python -m benchmarks.simulate --games 1000000 --players 5 7 10
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt
+from random import Random, randrange
+from time import monotonic
+
+from engine import Engine, GameStates
+
+
+def play(engine, random, approve_rate, sabotage_rate):
+    """Play `engine` to the end and return why it ended."""
+    players = engine.players
+    engine.start_round()
+    engine.start_nomination()
+    while True:
+        leader = players[engine.mission_leader]
+        others = [p for p in players if p != leader]
+        engine.nominate([leader] + random.sample(others, engine.mission_size() - 1))
+        for player in players:
+            engine.vote_nomination(player, random.random() < approve_rate)
+        if engine.tally_nomination():
+            spies = engine.spies
+            for player in engine.mission:
+                vote = player not in spies or random.random() >= sabotage_rate
+                engine.vote_mission(player, vote)
+            engine.tally_mission()
+            if engine.state == GameStates.GAME_OVER:
+                return "missions"
+            engine.start_round()
+        elif engine.state == GameStates.GAME_OVER:
+            return "rejections"
+        engine.start_nomination()
+
+
+def simulate(num_players, games, seed, approve_rate=0.6, sabotage_rate=0.8):
+    """Play `games` games and count outcomes as `(winner, reason)` pairs."""
+    random = Random(seed)
+    players = tuple(range(num_players))
+    outcomes = Counter()
+    for _ in range(games):
+        engine = Engine()
+        engine.begin(players, random)
+        reason = play(engine, random, approve_rate, sabotage_rate)
+        winner = "resistance" if engine.resistance_won() else "spies"
+        outcomes[winner, reason] += 1
+    return num_players, outcomes
+
+
+def win_rate(wins, games):
+    """Return the win rate and its 95% confidence interval half-width."""
+    rate = wins / games
+    return rate, 1.96 * sqrt(rate * (1 - rate) / games)
+
+
+def main(args):
+    totals = {n: Counter() for n in args.players}
+    start = monotonic()
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = []
+        for n in args.players:
+            for offset in range(0, args.games, args.batch_size):
+                games = min(args.batch_size, args.games - offset)
+                futures.append(
+                    executor.submit(
+                        simulate,
+                        n,
+                        games,
+                        randrange(2**32),
+                        args.approve_rate,
+                        args.sabotage_rate,
+                    )
+                )
+        for future in futures:
+            n, outcomes = future.result()
+            totals[n].update(outcomes)
+    elapsed = monotonic() - start
+
+    print("players  resistance won  spies won by missions  spies won by rejections")
+    for n, outcomes in totals.items():
+        rate, error = win_rate(outcomes["resistance", "missions"], args.games)
+        missions = outcomes["spies", "missions"] / args.games
+        rejections = outcomes["spies", "rejections"] / args.games
+        print(
+            f"{n:>7}  {rate:>6.1%} ± {error:.1%}  "
+            f"{missions:>21.1%}  {rejections:>23.1%}"
+        )
+    total = args.games * len(args.players)
+    print(f"{total} games in {elapsed:.1f} s ({total / elapsed:.0f} games/s)")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Simulate games of random bots.")
+    parser.add_argument("--games", type=int, default=100000, help="per player count")
+    parser.add_argument(
+        "--players", type=int, nargs="+", default=range(5, 11), choices=range(5, 11)
+    )
+    parser.add_argument("--workers", type=int, help="processes (default: all CPUs)")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument(
+        "--approve-rate", type=float, default=0.6, help="chance of approving a team"
+    )
+    parser.add_argument(
+        "--sabotage-rate",
+        type=float,
+        default=0.8,
+        help="chance of a spy failing a mission",
+    )
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,17 @@
+import os
+import shutil
+import tempfile
+
+
+def pytest_configure(config):
+    # before anything imports storage: keep the database and avatars that
+    # server.py uses out of the checkout
+    config.resistance_root = tempfile.mkdtemp(prefix="resistance-tests-")
+    os.environ["RESISTANCE_DATABASE"] = os.path.join(
+        config.resistance_root, "resistance.sqlite3"
+    )
+    os.environ["RESISTANCE_AVATARS"] = os.path.join(config.resistance_root, "avatars")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(config.resistance_root, ignore_errors=True)
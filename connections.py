@@ -0,0 +1,270 @@
+import asyncio
+from time import monotonic
+
+import metrics
+from protocol import JSON
+
+DISCONNECT = "disconnect"
+RESYNC = "resync"
+
+
+class SendQueue(asyncio.Queue):
+    """
+    Bounded queue of encoded frames waiting to be sent to one websocket.
+
+    `offer` never blocks, so a stalled client can't hold up a broadcast. When
+    the queue is full every pending frame is dropped and, depending on
+    `policy`, the connection is told to close (`DISCONNECT`) or to catch up
+    from the current game state once it drains (`RESYNC`). Frames are
+    encoded with `protocol`.
+    """
+
+    CLOSE = object()  # sentinel: close the connection
+    CATCH_UP = object()  # sentinel: send a fresh copy of the game state
+
+    def __init__(self, maxsize=256, policy=DISCONNECT, protocol=JSON):
+        if policy not in (DISCONNECT, RESYNC):
+            raise ValueError("Unknown overflow policy {!r}.".format(policy))
+        super().__init__(maxsize)
+        self.policy = policy
+        self.protocol = protocol
+        self.dropped = 0
+        self.overflows = 0
+        self._overflowed = False
+
+    def offer(self, frame):
+        """Queue a frame without waiting, applying the overflow policy if full."""
+        if self._overflowed:
+            self.dropped += 1  # the client will get a fresh state anyway
+            metrics.WS_FRAMES_DROPPED.inc()
+            return
+        try:
+            self.put_nowait(frame)
+        except asyncio.QueueFull:
+            self._overflow()
+            self.dropped += 1
+            metrics.WS_FRAMES_DROPPED.inc()
+
+    def _overflow(self):
+        self.overflows += 1
+        metrics.WS_OVERFLOWS.inc()
+        self._drop_all(self.CLOSE if self.policy == DISCONNECT else self.CATCH_UP)
+
+    def close(self):
+        """Drop any pending frames and tell the connection to close."""
+        self._drop_all(self.CLOSE)
+
+    def _drop_all(self, sentinel):
+        self._overflowed = True
+        while not self.empty():
+            self.get_nowait()
+            self.dropped += 1
+            metrics.WS_FRAMES_DROPPED.inc()
+        self.put_nowait(sentinel)
+
+    async def get(self):
+        frame = await super().get()
+        if frame is self.CATCH_UP:
+            self._overflowed = False
+        return frame
+
+
+class GameConnections:
+    """
+    The websockets open on one game, counted per user.
+
+    Iterates as `(queue, username)` pairs. Users may have several connections
+    (tabs), so `add` and `discard` say when a user's first one opens and last
+    one closes: only then has anyone joined or left.
+    """
+
+    def __init__(self):
+        self.queues = dict()  # SendQueue -> username
+        self.counts = dict()  # username -> open connections
+        self.held = False  # whether a game uses this, so it must be kept
+
+    def __iter__(self):
+        return iter(self.queues.items())
+
+    def __len__(self):
+        return len(self.queues)
+
+    def users(self):
+        """Return a set-like view of the users with a connection open."""
+        return self.counts.keys()
+
+    def add(self, queue, username):
+        """Add a connection, returning whether it's the user's first."""
+        self.queues[queue] = username
+        count = self.counts.get(username, 0)
+        self.counts[username] = count + 1
+        return count == 0
+
+    def discard(self, queue):
+        """Remove a connection, returning whether it was its user's last."""
+        if queue not in self.queues:
+            return False
+        username = self.queues.pop(queue)
+        count = self.counts[username] - 1
+        if count:
+            self.counts[username] = count
+            return False
+        del self.counts[username]
+        return True
+
+
+class ConnectionRegistry:
+    """
+    Every game's `GameConnections`, by game ID.
+
+    A game's entry lasts from `hold` to `release`; one for connections to a
+    game that doesn't exist here lasts only while they are open.
+    """
+
+    def __init__(self):
+        self.games = dict()  # game_id -> GameConnections
+        self.queues = dict()  # SendQueue -> its GameConnections, released or not
+
+    def __len__(self):
+        """Return how many connections are open, including to released games."""
+        return len(self.queues)
+
+    def hold(self, game_id):
+        """Return the connections of a game, keeping them until `release`."""
+        connections = self.games.get(game_id)
+        if connections is None:
+            connections = self.games[game_id] = GameConnections()
+        connections.held = True
+        return connections
+
+    def release(self, game_id):
+        """
+        Forget a game's connections.
+
+        Ones still open stay with the old entry, so a new game with the same
+        ID doesn't inherit them, and are counted until they disconnect.
+        """
+        self.games.pop(game_id, None)
+
+    def connect(self, game_id, queue, username):
+        """Add a connection, returning whether it's the user's first to the game."""
+        connections = self.games.get(game_id)
+        if connections is None:
+            connections = self.games[game_id] = GameConnections()
+        self.queues[queue] = connections
+        return connections.add(queue, username)
+
+    def disconnect(self, game_id, queue):
+        """
+        Remove a connection, returning whether it was its user's last to the
+        game (always False once the game has been released).
+        """
+        connections = self.queues.pop(queue, None)
+        if connections is None:
+            return False
+        left = connections.discard(queue)
+        if connections is not self.games.get(game_id):
+            return False  # released
+        if not connections and not connections.held:
+            del self.games[game_id]
+        return left
+
+
+class TokenBucket:
+    """
+    Allows `rate` actions a second on average, and bursts of up to `burst`.
+
+    Tokens are topped up lazily when one is asked for, so an idle bucket
+    costs nothing.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def has(self, tokens=1):
+        """Return whether there are `tokens`, without taking them."""
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= tokens
+
+    def take(self, tokens=1):
+        """Take `tokens` if there are that many, returning whether there were."""
+        if not self.has(tokens):
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class UserBuckets:
+    """
+    A `TokenBucket` per user, shared by all of their connections.
+
+    `open` and `close` count a user's connections, and a bucket is freed
+    along with the last one. Connections that aren't logged in have nobody
+    to share with, so callers should key them by something of their own,
+    like their `SendQueue`, rather than by `None`.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = dict()  # username (or key) -> (bucket, open connections)
+
+    def open(self, username):
+        """Return the user's bucket for a new connection."""
+        bucket, count = self.buckets.get(username, (None, 0))
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        self.buckets[username] = (bucket, count + 1)
+        return bucket
+
+    def close(self, username):
+        bucket, count = self.buckets[username]
+        if count == 1:
+            del self.buckets[username]
+        else:
+            self.buckets[username] = (bucket, count - 1)
+
+
+class Heartbeat:
+    """
+    Pings a websocket that has gone quiet, and closes it if that goes unanswered.
+
+    Call `heard()` whenever the client sends anything, and `stop()` when the
+    connection ends. Each connection has a single timer in `timers` at any
+    time, which checks when it fires whether the client has since been heard
+    from, so hearing from a client costs nothing but a timestamp.
+    """
+
+    PING = {"kind": "ping"}
+
+    def __init__(self, queue, timers, interval, timeout):
+        self.queue = queue
+        self.timers = timers
+        self.interval = interval
+        self.timeout = timeout
+        self.heard_at = monotonic()
+        self._timer = timers.call_at(self.heard_at + interval, self._check, None)
+
+    def heard(self):
+        self.heard_at = monotonic()
+
+    def stop(self):
+        self._timer.cancel()
+
+    def _check(self, pinged_at):
+        now = monotonic()
+        if pinged_at is not None and self.heard_at < pinged_at:
+            self.queue.close()  # no answer
+        elif self.heard_at + self.interval > now:
+            deadline = self.heard_at + self.interval
+            self._timer = self.timers.call_at(deadline, self._check, None)
+        else:
+            self.queue.offer(self.queue.protocol.encode(self.PING, {}))
+            self._timer = self.timers.call_at(now + self.timeout, self._check, now)
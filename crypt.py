@@ -1,5 +1,11 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from hashlib import pbkdf2_hmac
 from secrets import token_urlsafe
+from time import perf_counter
+
+import metrics
 
 
 def gen_salt():
@@ -10,3 +16,54 @@ def hash_password(password, salt):
     return pbkdf2_hmac(
         "sha512", bytes(password, "utf-8"), bytes(salt, "ascii"), 100000
     ).hex()
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already waiting to run."""
+
+
+class HashPool:
+    """Run `hash_password` in a bounded process pool.
+
+    At most `max_pending` hashes may be queued or running at once; further
+    requests fail fast with `HashingBusy` so callers can shed load.
+
+    Daemonic processes (e.g. Hypercorn workers) can't start child processes,
+    so there a thread pool is used instead. PBKDF2 releases the GIL, so the
+    threads still hash in parallel off the event loop.
+    """
+
+    def __init__(self, max_workers=None, max_pending=32):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    async def hash_password(self, password, salt):
+        """Hash a password without blocking the event loop."""
+        if self.pending >= self.max_pending:
+            raise HashingBusy()
+        if self._executor is None:
+            if multiprocessing.current_process().daemon:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.pending += 1
+        started = perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, hash_password, password, salt
+            )
+        finally:
+            self.pending -= 1
+            metrics.HASH_SECONDS.observe(perf_counter() - started)
+
+    def shutdown(self):
+        """Stop the worker processes, if any were started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+HASH_POOL = HashPool()
@@ -0,0 +1,52 @@
+"""
+In-memory directory of the games being played, pushed to subscribers.
+
+Games report a small summary whenever they start, change phase or gain or
+lose spectators; only summaries that actually changed are sent on, as one
+encoded frame shared by every subscriber. A directory page therefore costs
+one snapshot when it connects and O(changes) after that, however often it
+would otherwise have polled.
+"""
+
+from json import dumps
+
+
+class GameDirectory:
+    def __init__(self):
+        self.games = dict()  # game_id -> summary
+        self.subscribers = set()  # `connections.SendQueue`s
+        self._snapshot = None
+
+    def __len__(self):
+        return len(self.games)
+
+    def update(self, game_id, summary):
+        """Set a game's summary, telling subscribers if it changed."""
+        if self.games.get(game_id) != summary:
+            self.games[game_id] = summary
+            self._publish({"kind": "update", "game_id": game_id, "game": summary})
+
+    def remove(self, game_id):
+        if self.games.pop(game_id, None) is not None:
+            self._publish({"kind": "remove", "game_id": game_id})
+
+    def snapshot(self):
+        """Return an encoded `snapshot` message of every game, cached until a change."""
+        if self._snapshot is None:
+            self._snapshot = dumps({"kind": "snapshot", "games": self.games})
+        return self._snapshot
+
+    def subscribe(self, queue):
+        """Send `queue` a snapshot now and every change from here on."""
+        self.subscribers.add(queue)
+        queue.offer(self.snapshot())
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _publish(self, message):
+        self._snapshot = None
+        if self.subscribers:
+            frame = dumps(message)
+            for queue in self.subscribers:
+                queue.offer(frame)
@@ -0,0 +1,198 @@
+"""
+The rules of The Resistance as a small synchronous state machine.
+
+`Engine` holds only what the rules need and does no I/O, so it can be driven
+directly, as the simulator does for millions of games, or wrapped by
+`game.Game`, which adds connections, broadcasts and the event log.
+"""
+
+from enum import Enum, auto
+
+
+class GameStates(Enum):
+    NOT_STARTED = auto()
+    NOMINATING = auto()
+    VOTING_MISSION = auto()
+    RUNNING_MISSION = auto()
+    GAME_OVER = auto()
+    ABORTED = auto()
+
+
+class Engine:
+    """
+    State and transitions of one game.
+
+    Callers validate whose turn it is; the transition methods only check
+    what the rules themselves forbid and report what happened, leaving
+    messages to the caller.
+    """
+
+    __slots__ = (
+        "players",
+        "spies",
+        "state",
+        "mission_leader",
+        "round_num",
+        "successes",
+        "mission",
+        "nom_votes",
+        "mission_votes",
+        "nominations_rejected",
+        "mission_results",
+    )
+
+    def __init__(self):
+        self.players = ()
+        self.spies = ()
+        self.state = GameStates.NOT_STARTED
+        self.mission_leader = None
+        self.round_num = 0
+        self.successes = 0
+        self.mission = None
+        self.nom_votes = dict()
+        self.mission_votes = dict()
+        self.nominations_rejected = 0
+        self.mission_results = []  # (succeeded, num_fails) per mission
+
+    def begin(self, players, random):
+        """Seat `players`, then pick the first leader and the spies with `random`."""
+        self.players = players
+        self.mission_leader = random.randint(0, len(players) - 1)
+        self.spies = random.sample(players, k=NUM_SPIES_DICT[len(players)])
+
+    def start_round(self):
+        self.nominations_rejected = 0
+
+    def start_nomination(self):
+        """Open nominations and return the mission leader."""
+        self.state = GameStates.NOMINATING
+        return self.players[self.mission_leader]
+
+    def nominate(self, mission):
+        """Put a (valid) mission to a vote and return who nominated it."""
+        mission_leader = self.players[self.mission_leader]
+        self.state = GameStates.VOTING_MISSION
+        self.update_mission_leader()
+        self.nom_votes.clear()
+        self.mission = mission
+        return mission_leader
+
+    def vote_nomination(self, player_id, vote):
+        """Record a nomination vote; return whether every player has now voted."""
+        if player_id in self.players:
+            self.nom_votes[player_id] = bool(vote)
+        return len(self.nom_votes) == len(self.players)
+
+    def tally_nomination(self):
+        """
+        Decide the nomination vote and return whether it was approved.
+
+        Afterwards the mission is running, the game is over (five rejections
+        in a row), or a new nomination should be started.
+        """
+        approved = self.mission_approved(sum(self.nom_votes.values()))
+        if approved:
+            self.state = GameStates.RUNNING_MISSION
+            self.mission_votes.clear()
+        else:
+            self.nominations_rejected += 1
+            if self.nominations_rejected == 5:
+                self.state = GameStates.GAME_OVER
+        return approved
+
+    def vote_mission(self, player_id, vote):
+        """Record a mission vote; return whether the whole mission has voted."""
+        if player_id in self.mission:
+            self.mission_votes[player_id] = bool(vote)
+        return len(self.mission_votes) == len(self.mission)
+
+    def tally_mission(self):
+        """
+        Decide the mission and return `(succeeded, num_fails)`.
+
+        Afterwards either the game is over or the next round should start.
+        """
+        num_fails = sum(1 for vote in self.mission_votes.values() if not vote)
+        succeeded = self.mission_succeeds(num_fails)
+        self.mission_results.append((succeeded, num_fails))
+        if succeeded:
+            self.successes += 1
+        if self.game_over():
+            self.state = GameStates.GAME_OVER
+        else:
+            self.round_num += 1
+        return succeeded, num_fails
+
+    def last_mission_leader(self):
+        """Return who nominated the current mission."""
+        return self.players[(self.mission_leader - 1) % len(self.players)]
+
+    def mission_size(self):
+        """Determine the number of people on the current mission."""
+        num_players = len(self.players)
+        return NUM_AGENTS_DICT[num_players][self.round_num]
+
+    def validate_mission(self, mission):
+        """
+        Check that a possible mission is valid.
+
+        Specifically, it must:
+          - have type list
+          - have the length appropriate for the current mission size
+          - have unique members who are all players of this game
+        """
+
+        if type(mission) is not list or len(mission) != self.mission_size():
+            return False
+        for i in mission:
+            if i not in self.players:
+                return False
+        return len(set(mission)) == len(mission)
+
+    def update_mission_leader(self):
+        """Update who the mission leader is."""
+        num_players = len(self.players)
+        if self.mission_leader == num_players - 1:
+            self.mission_leader = 0
+        else:
+            self.mission_leader += 1
+
+    def mission_approved(self, num_approve):
+        """Check if a mission is approved."""
+        num_players = len(self.players)
+        return num_approve > num_players / 2
+
+    def mission_succeeds(self, num_fails):
+        """Check if a mission succeeds."""
+        return num_fails <= self.max_fails()
+
+    def max_fails(self):
+        """Get the maximum allowed number of fails for the current round."""
+        num_players = len(self.players)
+        if num_players >= 7 and self.round_num == 3:
+            return 1
+        else:
+            return 0
+
+    def game_over(self):
+        """Check if the game is over."""
+        fails = self.round_num - self.successes + 1
+        if self.round_num == 4:
+            return True
+        return self.successes == 3 or fails == 3
+
+    def resistance_won(self):
+        """Check if the resistance won. Assume the game is over."""
+        return self.successes == 3
+
+
+NUM_AGENTS_DICT = {
+    5: [2, 3, 2, 3, 3],
+    6: [2, 3, 4, 3, 4],
+    7: [2, 3, 3, 4, 4],
+    8: [3, 4, 4, 5, 5],
+    9: [3, 4, 4, 5, 5],
+    10: [3, 4, 4, 5, 5],
+}
+
+NUM_SPIES_DICT = {5: 2, 6: 2, 7: 3, 8: 3, 9: 4, 10: 4}
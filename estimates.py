@@ -0,0 +1,133 @@
+"""
+Live win-probability and spy-likelihood estimates for spectators.
+
+Every way of choosing the spies (`k` of `n` players, as `Engine.begin` does)
+is a row of a boolean matrix, at most C(10, 4) = 210 rows. Each vote and
+mission result multiplies the rows' weights by how likely it was under a
+simple model of play. An update is therefore a few NumPy operations over
+that matrix, not a fresh simulation. The resistance's chance of winning is
+a batched Monte Carlo rollout of the remaining missions, over spies drawn
+from those weights. It is cached until the next event.
+"""
+
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+from engine import NUM_AGENTS_DICT, NUM_SPIES_DICT
+
+# The model of play: a spy on a mission fails it with SABOTAGE_RATE; spies
+# approve teams with and without a spy on them at SPY_APPROVES; the
+# resistance, who can't tell, approve any team at RESISTANCE_APPROVES.
+SABOTAGE_RATE = 0.8
+SPY_APPROVES = (0.4, 0.8)
+RESISTANCE_APPROVES = 0.6
+
+SAMPLES = 2048  # rollouts per estimate
+
+_ASSIGNMENTS = {}
+
+
+def assignments(num_players):
+    """Return every possible choice of spies as a boolean (rows, players) matrix."""
+    matrix = _ASSIGNMENTS.get(num_players)
+    if matrix is None:
+        spies = list(combinations(range(num_players), NUM_SPIES_DICT[num_players]))
+        matrix = np.zeros((len(spies), num_players), dtype=bool)
+        for row, chosen in enumerate(spies):
+            matrix[row, list(chosen)] = True
+        _ASSIGNMENTS[num_players] = matrix
+    return matrix
+
+
+def _fail_likelihoods(num_fails, rate=SABOTAGE_RATE):
+    """Return P(num_fails | s spies on the mission) for s = 0..5, as an array."""
+    return np.array(
+        [
+            comb(s, num_fails) * rate**num_fails * (1 - rate) ** (s - num_fails)
+            for s in range(6)
+        ]
+    )
+
+
+class Estimator:
+    """Estimates for one game, updated as its votes and missions happen."""
+
+    def __init__(self, num_players, samples=SAMPLES):
+        self.num_players = num_players
+        self.assignments = assignments(num_players)
+        self.log_weights = np.zeros(len(self.assignments))
+        self.samples = samples
+        self.rng = np.random.default_rng()
+        self._summary = None
+
+    def nomination_votes(self, team, approvals):
+        """
+        Weigh a nomination vote.
+
+        `team` holds the player indices on the nominated mission and
+        `approvals` each player's vote, in seating order.
+        """
+        spy_on_team = self.assignments[:, team].any(axis=1)
+        spy_approves = np.where(spy_on_team, SPY_APPROVES[1], SPY_APPROVES[0])
+        p = np.where(self.assignments, spy_approves[:, None], RESISTANCE_APPROVES)
+        approvals = np.asarray(approvals, dtype=bool)
+        self.log_weights += np.log(np.where(approvals, p, 1 - p)).sum(axis=1)
+        self._summary = None
+
+    def mission_result(self, team, num_fails):
+        """Weigh the result of a mission with players `team` on it."""
+        spies_on_team = self.assignments[:, team].sum(axis=1)
+        with np.errstate(divide="ignore"):  # impossible assignments get -inf
+            log_weights = self.log_weights + np.log(
+                _fail_likelihoods(num_fails)[spies_on_team]
+            )
+        # more fails than any assignment explains: the resistance sabotaged
+        # too, which the model doesn't cover, so learn nothing from it
+        if np.isfinite(log_weights).any():
+            self.log_weights = log_weights
+            self._summary = None
+
+    def probabilities(self):
+        """Return how likely each spy assignment is, given everything so far."""
+        weights = np.exp(self.log_weights - self.log_weights.max())
+        return weights / weights.sum()
+
+    def summary(self, round_num, successes):
+        """
+        Return `{"resistance_wins": p, "spy_likelihood": [p, ...]}`.
+
+        Call with the round and successes after the last event given; the
+        result is cached until the next one.
+        """
+        if self._summary is None:
+            probabilities = self.probabilities()
+            self._summary = {
+                "resistance_wins": self.rollout(probabilities, round_num, successes),
+                "spy_likelihood": (probabilities @ self.assignments).round(3).tolist(),
+            }
+        return self._summary
+
+    def rollout(self, probabilities, round_num, successes):
+        """
+        Play out the remaining missions `self.samples` times at once.
+
+        Teams are random, as if nominated blindly, and the vote track is
+        ignored, so this is a rough guide rather than a forecast.
+        """
+        n, samples, rng = self.num_players, self.samples, self.rng
+        rows = rng.choice(len(probabilities), size=samples, p=probabilities)
+        spies = self.assignments[rows]
+        succeeded = np.full(samples, successes)
+        failed = np.full(samples, round_num - successes)
+        for mission in range(round_num, 5):
+            size = NUM_AGENTS_DICT[n][mission]
+            teams = np.argsort(rng.random((samples, n)), axis=1)[:, :size]
+            on_team = np.take_along_axis(spies, teams, axis=1).sum(axis=1)
+            num_fails = rng.binomial(on_team, SABOTAGE_RATE)
+            passed = num_fails <= (1 if n >= 7 and mission == 3 else 0)
+            playing = (succeeded < 3) & (failed < 3)
+            succeeded += passed & playing
+            failed += ~passed & playing
+        return round(float((succeeded >= 3).mean()), 3)
@@ -1,37 +1,51 @@
-from enum import Enum, auto
-from random import randint, sample
-from time import monotonic
+from random import Random, randrange
+from time import monotonic, perf_counter
 
-
-class GameStates(Enum):
-    NOT_STARTED = auto()
-    NOMINATING = auto()
-    VOTING_MISSION = auto()
-    RUNNING_MISSION = auto()
-    GAME_OVER = auto()
-    ABORTED = auto()
+import metrics
+from profiling import PROFILER
+from engine import NUM_AGENTS_DICT, Engine, GameStates
+from estimates import Estimator
 
 
 class Game:
-    def __init__(self, connections, when_started=None, when_finished=None):
-        self.connections = connections  # mutable reference outside of this scope.
-        self.players = ()  # should be immutable or owned by this class
+    """
+    A game played over websocket connections.
+
+    The rules and their state live in `self.engine`; this class turns moves
+    into engine transitions and the transitions into broadcasts.
+    """
+
+    def __init__(
+        self,
+        connections,
+        when_started=None,
+        when_finished=None,
+        event_log=None,
+        when_changed=None,
+        timers=None,
+        turn_timeouts=None,
+    ):
+        self.connections = connections  # a `connections.GameConnections`, shared.
         self.lobby = set()
         self.ready = set()
         self.when_started = when_started
         self.when_finished = when_finished
-        self.state = GameStates.NOT_STARTED
-        self.spies = None
-        self.mission_leader = None
-        self.round_num = 0
-        self.successes = 0
-        self.mission = None
-        self.nom_votes = dict()
-        self.mission_votes = dict()
-        self.nominations_rejected = 0
-        self.mission_results = []
+        self.when_changed = when_changed  # called when `summary()` may differ
+        self.event_log = event_log  # called with (kind, data) for each transition
+        self.timers = timers  # a `maintenance.Timers`, for `turn_timeouts`
+        self.turn_timeouts = turn_timeouts or dict()  # state name -> seconds
+        self._turn_timer = None
+        self.timed_out = False  # whether `turn_timed_out` made any moves
+        self.seed = None
+        self.random = Random()
+        self._replaying = False
+        self.engine = Engine()
+        self.seats = dict()  # player_id -> index in the seating order
+        self.estimator = None  # spectators' win and spy estimates, once started
         self.last_state_change_message = dict()
         self.last_communication = monotonic()
+        self.seq = 0  # sequence number of the last broadcast
+        self._snapshots = dict()  # (role, protocol) -> snapshot, until the next change
 
         self.STATES = {
             GameStates.NOT_STARTED: self.not_started,
@@ -42,14 +56,28 @@ class Game:
             GameStates.ABORTED: lambda player_id, move: 0,  # do nothing
         }
 
+    @property
+    def state(self):
+        return self.engine.state
+
+    @property
+    def players(self):
+        return self.engine.players
+
+    @property
+    def spies(self):
+        return self.engine.spies
+
     async def player_move(self, player_id, move, queue):
         self.communicated()
         if type(move) is not dict:
             return
         if move.get("kind") == "catch_up":
-            return await self.catch_up(player_id, queue)
+            with PROFILER.span("catch_up"):
+                return await self.catch_up(player_id, queue)
         handler = self.STATES[self.state]
-        await handler(player_id, move)
+        with PROFILER.span(self.state.name, move.get("kind")):
+            await handler(player_id, move)
 
     async def not_started(self, player_id, move):
         kind = move.get("kind")
@@ -60,28 +88,54 @@ class Game:
         pass
 
     async def broadcast(self, message):
-        for client, _ in self.connections:
-            await client.put(message)
-        self.communicated()
+        started = perf_counter()
+        self.seq += 1
+        self.changed()
+        with PROFILER.span("broadcast", message["kind"]):
+            message = dict(message, seq=self.seq)
+            self.send(message, (client for client, _ in self.connections))
+        metrics.BROADCAST_SECONDS.observe(perf_counter() - started)
+
+    def send(self, message, connections):
+        """Queue `message` for `connections`, encoding it once per protocol."""
+        frames = dict()
+        for connection in connections:
+            protocol = connection.protocol
+            frame = frames.get(protocol)
+            if frame is None:
+                with PROFILER.span("encode", protocol.name):
+                    frame = frames[protocol] = protocol.encode(message, self.seats)
+            connection.offer(frame)
+
+    def changed(self):
+        """Note that the game state changed, so cached snapshots are stale."""
+        self._snapshots.clear()
 
     def can_join(self, player_id):
         return True
 
     async def join(self, player_id):
+        """Note a user's first connection to the game."""
+        self.communicated()
         if self.state == GameStates.NOT_STARTED:
             self.lobby.add(player_id)
             await self.broadcast({"kind": "lobby_update", "players": list(self.lobby)})
+        else:
+            if self._turn_timer is None:
+                self.start_turn_timer()  # paused while no player was connected
+            self.notify()  # maybe a new spectator
 
     async def discard(self, player_id):
-        # since we allow duplicate connections, we can't go off of player_id alone.
+        """Note that a user's last connection to the game has closed."""
         if self.state == GameStates.NOT_STARTED:
-            lobby = set(name for _, name in self.connections)
-            if lobby != self.lobby:
-                self.lobby = lobby
+            if player_id in self.lobby:
+                self.lobby.discard(player_id)
                 await self.broadcast(
                     {"kind": "lobby_update", "players": list(self.lobby)}
                 )
                 await self.start()
+        else:
+            self.notify()
 
     async def mark_ready(self, player_id):
         self.ready.add(player_id)
@@ -91,285 +145,379 @@ class Game:
         await self.start()
 
     async def start(self):
-        players = set(name for _, name in self.connections)
+        players = self.connections.users()
 
-        if not players.issubset(self.ready):
+        if not players <= self.ready:
             return  # not everyone is ready. bail.
 
         if not (5 <= len(players) <= 10):
             return  # client made a bad request
 
-        self.players = tuple(players)
+        await self.begin(tuple(players), randrange(2**32))
+
+    async def begin(self, players, seed):
+        """Start the game with a fixed seating order and random seed."""
+        self.seed = seed
+        self.random.seed(seed)
+        self.record("start", players=players, seed=seed)
 
         if self.when_started is not None:
             self.when_started()
 
-        self.choose_mission_leader()
-        self.make_roles()
+        self.engine.begin(players, self.random)
+        self.seats = {player: seat for seat, player in enumerate(players)}
+        self.estimator = Estimator(len(players))
 
-        base_message = {
+        self.seq += 1
+        self.changed()
+        # each role sees its own variant
+        audiences = {role: [] for role in ROLES}
+        for connection, player_id in self.connections:
+            audiences[self.role(player_id)].append(connection)
+        for role, connections in audiences.items():
+            self.send(dict(self.start_message(role), seq=self.seq), connections)
+        await self.start_round()
+
+    def role(self, player_id):
+        """Return which of `ROLES` a connected user has in this game."""
+        if player_id in self.spies:
+            return "spy"
+        elif player_id in self.players:
+            return "resistance"
+        return "spectator"
+
+    def start_message(self, role):
+        """Build the `game_start` message as seen by someone with `role`."""
+        message = {
             "kind": "game_start",
             "players": self.players,
             "num_players": len(self.players),
             "num_spies": len(self.spies),
             "agents_per_round": NUM_AGENTS_DICT[len(self.players)],
+            "is_player": role != "spectator",
         }
-        spy_message = dict(
-            is_spy=True, spies=self.spies, is_player=True, **base_message,
-        )
-        resistance_message = dict(is_spy=False, is_player=True, **base_message)
-        spectator_message = dict(is_player=False, **base_message)
-        for connection, player_id in self.connections:
-            if player_id in self.spies:
-                await connection.put(spy_message)
-            elif player_id in self.players:
-                await connection.put(resistance_message)
-            else:
-                await connection.put(spectator_message)
-        await self.start_round()
+        if role == "spy":
+            message.update(is_spy=True, spies=self.spies)
+        elif role == "resistance":
+            message.update(is_spy=False)
+        return message
 
     async def start_round(self):
-        self.nominations_rejected = 0
-        await self.broadcast(
-            {
-                "kind": "round_start",
-                "mission_size": self.mission_size(),
-                "mission_number": self.round_num,
-            }
-        )
+        self.engine.start_round()
+        await self.broadcast(self.round_message())
         await self.start_nomination()
 
+    def round_message(self):
+        return {
+            "kind": "round_start",
+            "mission_size": self.engine.mission_size(),
+            "mission_number": self.engine.round_num,
+        }
+
     async def start_nomination(self):
-        mission_leader = self.players[self.mission_leader]
-        self.state = GameStates.NOMINATING
         message = {
             "kind": "nomination_start",
-            "mission_leader": mission_leader,
-            "vote_track": self.nominations_rejected,
+            "mission_leader": self.engine.start_nomination(),
+            "vote_track": self.engine.nominations_rejected,
         }
         await self.broadcast(message)
         self.last_state_change_message = message
+        self.notify()
+        self.start_turn_timer()
 
     async def nominating(self, player_id, move):
+        engine = self.engine
         if (
             move.get("kind") == "nominate"
-            and player_id == self.players[self.mission_leader]
+            and player_id == engine.players[engine.mission_leader]
         ):
             nominated_mission = move.get("nomination")
-            if self.validate_mission(nominated_mission):
-                self.state = GameStates.VOTING_MISSION
-                self.update_mission_leader()
-                self.nom_votes.clear()
-                self.mission = nominated_mission
-                message = {
-                    "kind": "mission_nominated",
-                    "mission": nominated_mission,
-                    "mission_leader": player_id,
-                }
-                await self.broadcast(message)
-                self.last_state_change_message = message
+            if engine.validate_mission(nominated_mission):
+                await self.nominate(nominated_mission)
+
+    async def nominate(self, nominated_mission):
+        """Put the current mission leader's (valid) nomination to a vote."""
+        self.record("nominate", mission=nominated_mission)
+        message = {
+            "kind": "mission_nominated",
+            "mission": nominated_mission,
+            "mission_leader": self.engine.nominate(nominated_mission),
+        }
+        await self.broadcast(message)
+        self.last_state_change_message = message
+        self.notify()
+        self.start_turn_timer()
 
     async def voting_mission(self, player_id, move):
-        if move.get("kind") == "nomination_vote" and player_id in self.players:
-            self.nom_votes[player_id] = bool(move.get("vote"))
-            if len(self.nom_votes) == len(self.players):
+        if move.get("kind") == "nomination_vote":
+            everyone_voted = self.engine.vote_nomination(player_id, move.get("vote"))
+            self.changed()
+            if everyone_voted:
                 await self.process_votes()
 
     async def process_votes(self):
-        approved = self.mission_approved(sum(self.nom_votes.values()))
+        engine = self.engine
+        self.record("nomination_votes", votes=engine.nom_votes)
+        vote_track = engine.nominations_rejected
+        approved = engine.tally_nomination()
+        self.estimator.nomination_votes(
+            [self.seats[player] for player in engine.mission],
+            [engine.nom_votes[player] for player in engine.players],
+        )
         await self.broadcast(
             {
                 "kind": "nomination_vote_results",
-                "results": self.nom_votes,
+                "results": engine.nom_votes,
                 "approved": approved,
-                "vote_track": self.nominations_rejected,
-                "mission": self.mission,
+                "vote_track": vote_track,
+                "mission": engine.mission,
             }
         )
+        self.send_estimate()
         if approved:
-            self.state = GameStates.RUNNING_MISSION
             await self.start_mission()
+        elif engine.state == GameStates.GAME_OVER:
+            await self.end_game()
         else:
-            self.nominations_rejected += 1
-            if self.nominations_rejected == 5:
-                await self.end_game()
-            else:
-                await self.start_nomination()
+            await self.start_nomination()
 
     async def start_mission(self):
-        self.mission_votes.clear()
         message = {
             "kind": "mission_start",
-            "mission": self.mission,
-            "mission_leader": self.players[
-                (self.mission_leader - 1) % len(self.players)
-            ],
+            "mission": self.engine.mission,
+            "mission_leader": self.engine.last_mission_leader(),
         }
         await self.broadcast(message)
         self.last_state_change_message = message
+        self.notify()
+        self.start_turn_timer()
 
     async def running_mission(self, player_id, move):
-        if move.get("kind") == "mission_vote" and player_id in self.mission:
-            self.mission_votes[player_id] = bool(move.get("vote"))
-            if len(self.mission_votes) == len(self.mission):
+        if move.get("kind") == "mission_vote":
+            everyone_voted = self.engine.vote_mission(player_id, move.get("vote"))
+            self.changed()
+            if everyone_voted:
                 await self.process_mission()
 
     async def process_mission(self):
-        num_fails = sum(1 for vote in self.mission_votes.values() if not vote)
-        mission_succeeded = self.mission_succeeds(num_fails)
-        mission_result = {
-            "kind": "mission_result",
-            "mission_number": self.round_num,
-            "mission_succeeded": mission_succeeded,
-            "num_fails": num_fails,
-        }
-        self.mission_results.append(mission_result)
-        await self.broadcast(mission_result)
-        if mission_succeeded:
-            self.successes += 1
-        if self.game_over():
+        engine = self.engine
+        self.record("mission_votes", votes=engine.mission_votes)
+        mission_number = engine.round_num
+        succeeded, num_fails = engine.tally_mission()
+        self.estimator.mission_result(
+            [self.seats[player] for player in engine.mission], num_fails
+        )
+        await self.broadcast(result_message(mission_number, succeeded, num_fails))
+        self.send_estimate()
+        if engine.state == GameStates.GAME_OVER:
             await self.end_game()
         else:
-            self.round_num += 1
             await self.start_round()
 
     async def end_game(self):
-        self.state = GameStates.GAME_OVER
-        await self.broadcast(
-            {
-                "kind": "game_over",
-                "resistance_won": self.resistance_won(),
-                "spies": list(self.spies),
-            }
-        )
+        self.engine.state = GameStates.GAME_OVER
+        self.start_turn_timer()  # i.e. stop it
+        resistance_won = self.engine.resistance_won()
+        self.record("end", resistance_won=resistance_won)
+        message = {
+            "kind": "game_over",
+            "resistance_won": resistance_won,
+            "spies": list(self.spies),
+        }
+        await self.broadcast(message)
+        self.last_state_change_message = message
         if self.when_finished is not None:
             self.when_finished()
 
     def abort(self):
         """Provide the ability to forcibly abort the game from an external caller."""
-        self.state = GameStates.ABORTED
+        self.engine.state = GameStates.ABORTED
+        self.start_turn_timer()  # i.e. stop it
+        self.record("abort")
         if self.when_finished is not None:
             self.when_finished()
 
-    async def catch_up(self, player_id, connection):
-        state = self.state
-        if state in (GameStates.NOT_STARTED, GameStates.GAME_OVER):
-            return
+    def start_turn_timer(self):
+        """Restart the clock for the current phase, if it has a time limit."""
+        if self._turn_timer is not None:
+            self._turn_timer.cancel()
+            self._turn_timer = None
+        timeout = self.turn_timeouts.get(self.state.name)
+        if self.timers is not None and timeout is not None:
+            self._turn_timer = self.timers.call_later(timeout, self.turn_timed_out)
 
-        base_message = {
-            "kind": "game_start",
-            "players": self.players,
-            "num_players": len(self.players),
-            "num_spies": len(self.spies),
-            "agents_per_round": NUM_AGENTS_DICT[len(self.players)],
-        }
-        if player_id in self.spies:
-            await connection.put(
-                dict(is_spy=True, spies=self.spies, is_player=True, **base_message,)
+    async def turn_timed_out(self):
+        """
+        Make the moves that whoever is holding up the current phase hasn't.
+
+        If none of the players are connected, nothing is done: the clock
+        stays stopped until someone joins again, and a game nobody comes
+        back to is left to be aborted as idle.
+        """
+        self._turn_timer = None
+        if not any(player_id in self.seats for player_id in self.connections.users()):
+            return
+        if self.state in PLAYING:
+            self.timed_out = True
+            self.record("timeout")
+        engine = self.engine
+        if self.state == GameStates.NOMINATING:
+            # the leader and whoever sits after them
+            seats = range(
+                engine.mission_leader, engine.mission_leader + engine.mission_size()
             )
-        elif player_id in self.players:
-            await connection.put(dict(is_spy=False, is_player=True, **base_message))
-        else:
-            await connection.put(dict(is_player=False, **base_message))
+            players = engine.players
+            await self.nominate([players[seat % len(players)] for seat in seats])
+        elif self.state == GameStates.VOTING_MISSION:
+            for player_id in engine.players:
+                if player_id not in engine.nom_votes:
+                    engine.vote_nomination(player_id, False)  # silence rejects
+            self.changed()
+            await self.process_votes()
+        elif self.state == GameStates.RUNNING_MISSION:
+            for player_id in engine.mission:
+                if player_id not in engine.mission_votes:
+                    engine.vote_mission(player_id, True)  # silence doesn't sabotage
+            self.changed()
+            await self.process_mission()
+
+    def record(self, kind, **data):
+        """Append a state transition to the event log, unless replaying it."""
+        if self.event_log is not None and not self._replaying:
+            self.event_log(kind, data)
+
+    async def replay(self, events):
+        """
+        Rebuild the game from the (kind, data) events it recorded.
 
-        for mission in self.mission_results:
-            await connection.put(mission)
+        Randomness is reproduced from the seed in the `start` event, so the
+        result matches the original game exactly. Nothing is recorded again.
+        """
+        self._replaying = True
+        try:
+            for kind, data in events:
+                if kind == "start":
+                    await self.begin(tuple(data["players"]), data["seed"])
+                elif kind == "nominate":
+                    await self.nominate(data["mission"])
+                elif kind == "nomination_votes":
+                    self.engine.nom_votes.update(data["votes"])
+                    await self.process_votes()
+                elif kind == "mission_votes":
+                    self.engine.mission_votes.update(data["votes"])
+                    await self.process_mission()
+                elif kind == "timeout":
+                    self.timed_out = True
+                elif kind == "abort":
+                    self.abort()
+                # "end" follows from the votes before it
+        finally:
+            self._replaying = False
 
-        await connection.put(
-            {
-                "kind": "round_start",
-                "mission_size": self.mission_size(),
-                "mission_number": self.round_num,
-            }
+    async def catch_up(self, player_id, connection):
+        """
+        Send a connection the whole current game state in a single frame.
+
+        Finished and aborted games send their final state, so a client that
+        fell behind as the game ended still learns how it ended.
+        """
+        connection.offer(self.snapshot(player_id, connection.protocol))
+
+    def snapshot(self, player_id, protocol):
+        """
+        Return a `snapshot` message of the game as `player_id` sees it, encoded
+        with `protocol`.
+
+        Its `seq` is that of the last broadcast, so a client can apply any
+        later broadcast on top of it. Snapshots are cached per role and
+        protocol until the game next changes.
+        """
+        role = self.role(player_id) if self.players else "lobby"  # i.e. if begun
+        frame = self._snapshots.get((role, protocol))
+        if frame is not None:
+            return frame
+
+        message = {"kind": "snapshot", "seq": self.seq, "state": self.state.name}
+        if role == "lobby":
+            message.update(
+                lobby=list(self.lobby), waiting=list(self.lobby - self.ready)
+            )
+        else:
+            engine = self.engine
+            message.update(
+                game_start=self.start_message(role),
+                mission_results=[
+                    result_message(number, *result)
+                    for number, result in enumerate(engine.mission_results)
+                ],
+                round_start=self.round_message(),
+                last_state_change=self.last_state_change_message,
+                nomination_votes=list(engine.nom_votes),  # who has voted, not how
+                mission_votes=list(engine.mission_votes),
+            )
+            if role == "spectator":
+                message.update(estimate=self.estimate())
+        frame = self._snapshots[role, protocol] = protocol.encode(message, self.seats)
+        return frame
+
+    def estimate(self):
+        """Return the spectators' `estimate` message for the game so far."""
+        engine = self.engine
+        summary = self.estimator.summary(engine.round_num, engine.successes)
+        return dict(summary, kind="estimate")
+
+    def send_estimate(self):
+        """Send spectators fresh estimates, if any are watching the game."""
+        if self.state == GameStates.GAME_OVER or self._replaying:
+            return
+        spectators = [
+            connection
+            for connection, player_id in self.connections
+            if player_id not in self.seats
+        ]
+        if spectators:
+            self.send(self.estimate(), spectators)  # not a broadcast: no seq
+
+    def summary(self):
+        """Return what the live games directory shows about this game."""
+        engine = self.engine
+        spectators = sum(
+            1 for player_id in self.connections.users() if player_id not in self.seats
         )
+        return {
+            "state": self.state.name,
+            "players": len(engine.players),
+            "spectators": spectators,
+            "round": engine.round_num + 1,
+            "successes": engine.successes,
+            "failures": len(engine.mission_results) - engine.successes,
+        }
 
-        await connection.put(self.last_state_change_message)
+    def notify(self):
+        """Call `when_changed` if the game is in progress."""
+        if self.when_changed is not None and self.state in PLAYING:
+            self.when_changed()
 
     def communicated(self):
         self.last_communication = monotonic()
 
-    def make_roles(self):
-        """Assign roles to players."""
-        num_roles = len(self.players)
-
-        if num_roles == 5 or num_roles == 6:
-            num_spies = 2
-        elif num_roles == 7 or num_roles == 8:
-            num_spies = 3
-        else:
-            num_spies = 4
-
-        self.spies = sample(self.players, k=num_spies)
 
-    def choose_mission_leader(self):
-        """Randomly select a player to be the first mission leader."""
-        num_players = len(self.players)
-        self.mission_leader = randint(0, num_players - 1)
+def result_message(mission_number, succeeded, num_fails):
+    return {
+        "kind": "mission_result",
+        "mission_number": mission_number,
+        "mission_succeeded": succeeded,
+        "num_fails": num_fails,
+    }
 
-    def mission_size(self):
-        """Determine the number of people on the current mission."""
-        num_players = len(self.players)
-        return NUM_AGENTS_DICT[num_players][self.round_num]
 
-    def validate_mission(self, mission):
-        """
-        Check that a possible mission is valid.
+ROLES = ("spy", "resistance", "spectator")
 
-        Specifically, it must:
-          - have type list
-          - have the length appropriate for the current mission size
-          - have unique members who are all players of this game
-        """
+# kinds of move `Game.player_move` acts on
+MOVES = frozenset(["catch_up", "start", "nominate", "nomination_vote", "mission_vote"])
 
-        if type(mission) is not list or len(mission) != self.mission_size():
-            return False
-        for i in mission:
-            if i not in self.players:
-                return False
-        return len(set(mission)) == len(mission)
-
-    def update_mission_leader(self):
-        """Update who the mission leader is."""
-        num_players = len(self.players)
-        if self.mission_leader == num_players - 1:
-            self.mission_leader = 0
-        else:
-            self.mission_leader += 1
-
-    def mission_approved(self, num_approve):
-        """Check if a mission is approved."""
-        num_players = len(self.players)
-        return num_approve > num_players / 2
-
-    def mission_succeeds(self, num_fails):
-        """Check if a mission succeeds."""
-        return num_fails <= self.max_fails()
-
-    def max_fails(self):
-        """Get the maximum allowed number of fails for the current round."""
-        num_players = len(self.players)
-        if num_players >= 7 and self.round_num == 3:
-            return 1
-        else:
-            return 0
-
-    def game_over(self):
-        """Check if the game is over."""
-        fails = self.round_num - self.successes + 1
-        if self.round_num == 4:
-            return True
-        return self.successes == 3 or fails == 3
-
-    def resistance_won(self):
-        """Check if the resistance won. Assume the game is over."""
-        return self.successes == 3
-
-
-NUM_AGENTS_DICT = {
-    5: [2, 3, 2, 3, 3],
-    6: [2, 3, 4, 3, 4],
-    7: [2, 3, 3, 4, 4],
-    8: [3, 4, 4, 5, 5],
-    9: [3, 4, 4, 5, 5],
-    10: [3, 4, 4, 5, 5],
-}
+PLAYING = (
+    GameStates.NOMINATING,
+    GameStates.VOTING_MISSION,
+    GameStates.RUNNING_MISSION,
+)
@@ -0,0 +1,250 @@
+"""
+Load-test a running server with simulated players.
+
+Registers and logs in bot users through the normal forms, then plays many
+concurrent games of bots (plus spectators) over the game websocket, making
+random legal moves and occasionally reconnecting. Reports move-to-broadcast
+latency, message throughput, bytes received with the chosen `--protocol`
+and, given `--server-pid`, the server's memory.
+
+    python loadtest.py http://127.0.0.1:5000 --games 20 --players 7
+
+Requires aiohttp. Exits non-zero if any game fails to finish in time.
+"""
+
+import asyncio
+import random
+from argparse import ArgumentParser
+from json import dumps
+from secrets import token_hex
+from statistics import quantiles
+from time import monotonic
+
+import aiohttp
+
+from protocol import PROTOCOLS
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.messages = 0
+        self.bytes = 0
+        self.reconnects = 0
+        self.peak_rss = 0
+
+
+class GameRun:
+    """Shared state for the bots in one game."""
+
+    def __init__(self, game_id, num_players):
+        self.game_id = game_id
+        self.num_players = num_players
+        self.started = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.last_move_at = None
+
+
+# broadcasts that are the direct result of a player's move
+RESULT_KINDS = {"mission_nominated", "nomination_vote_results", "mission_result"}
+
+
+class Bot:
+    def __init__(self, session, base_url, username, run, stats, is_player, protocol):
+        self.session = session
+        self.base_url = base_url
+        self.username = username
+        self.run = run
+        self.stats = stats
+        self.is_player = is_player
+        self.protocol = protocol
+        self.players = []
+        self.spies = []
+        self.mission_size = 0
+        self.ws = None
+
+    async def sign_up(self):
+        form = {"username": self.username, "password": "load-test"}
+        for path in ("/sign_up", "/log_in"):
+            while True:
+                async with self.session.post(self.base_url + path, data=form) as r:
+                    if r.status != 503:  # password hashing is saturated
+                        break
+                await asyncio.sleep(random.random())
+
+    async def connect(self):
+        # the page may redirect to the worker that owns the game
+        play_url = f"{self.base_url}/play/{self.run.game_id}/"
+        async with self.session.get(play_url) as response:
+            ws_url = str(response.url).replace("http", "ws", 1) + "ws"
+        self.ws = await self.session.ws_connect(ws_url, protocols=[self.protocol.name])
+        await self.send({"kind": "catch_up"})
+
+    async def send(self, move):
+        if move["kind"] != "catch_up":
+            self.run.last_move_at = monotonic()
+        await self.ws.send_str(dumps(move))
+
+    async def play(self, reconnect_rate):
+        await self.connect()
+        if self.is_player:
+            await self.send({"kind": "start"})
+        while not self.run.finished.is_set():
+            message = await self.ws.receive()
+            if message.type == aiohttp.WSMsgType.TEXT:
+                self.stats.bytes += len(message.data.encode())
+            elif message.type == aiohttp.WSMsgType.BINARY:
+                self.stats.bytes += len(message.data)
+            else:
+                await self.reconnect()
+                continue
+            self.stats.messages += 1
+            update = self.protocol.decode(message.data, self.players)
+            if update["kind"] in RESULT_KINDS and self.run.last_move_at is not None:
+                self.stats.latencies.append(monotonic() - self.run.last_move_at)
+            await self.handle(update)
+            if random.random() < reconnect_rate:
+                await self.reconnect()
+        await self.ws.close()
+
+    async def reconnect(self):
+        if self.run.finished.is_set():
+            return  # reconnecting now would create a new game
+        self.stats.reconnects += 1
+        await self.ws.close()
+        try:
+            await self.connect()
+        except aiohttp.WSServerHandshakeError:
+            # the game finished and was cleaned up while we were away
+            await self.run.finished.wait()
+
+    async def handle(self, update):
+        kind = update["kind"]
+        if kind == "snapshot":
+            state = update["state"]
+            if state == "NOT_STARTED":
+                if self.is_player:  # leaving the lobby dropped our ready flag
+                    await self.send({"kind": "start"})
+                return
+            await self.handle(update["game_start"])
+            await self.handle(update["round_start"])
+            if state == "VOTING_MISSION":
+                already_moved = self.username in update["nomination_votes"]
+            else:
+                already_moved = self.username in update["mission_votes"]
+            if state == "NOMINATING" or not already_moved:
+                await self.handle(update["last_state_change"])
+        elif kind == "game_start":
+            self.players = list(update["players"])
+            self.spies = update.get("spies", [])
+            self.run.started.set()
+        elif kind == "round_start":
+            self.mission_size = update["mission_size"]
+        elif kind == "nomination_start":
+            if update["mission_leader"] == self.username:
+                others = [p for p in self.players if p != self.username]
+                mission = [self.username] + random.sample(others, self.mission_size - 1)
+                await self.send({"kind": "nominate", "nomination": mission})
+        elif kind == "mission_nominated":
+            if self.username in self.players:
+                await self.send(
+                    {"kind": "nomination_vote", "vote": random.random() < 0.6}
+                )
+        elif kind == "mission_start":
+            if self.username in update["mission"]:
+                vote = self.username not in self.spies or random.random() < 0.5
+                await self.send({"kind": "mission_vote", "vote": vote})
+        elif kind == "game_over":
+            self.run.finished.set()
+        elif kind == "ping":
+            await self.ws.send_str(dumps({"kind": "pong"}))  # not a move
+
+
+async def spectate(bot, reconnect_rate):
+    await bot.run.started.wait()  # spectators who join early count as players
+    await bot.play(reconnect_rate)
+
+
+async def sample_rss(pid, stats):
+    while True:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    stats.peak_rss = max(stats.peak_rss, int(line.split()[1]))
+        await asyncio.sleep(0.5)
+
+
+async def run_game(args, stats, prefix, game_number):
+    run = GameRun(random.randrange(10**9), args.players)
+    bots = []
+    for i in range(args.players + args.spectators):
+        # unsafe=True: keep cookies from servers addressed by IP, e.g. 127.0.0.1
+        session = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+        username = f"{prefix}{game_number}_{i}"
+        is_player = i < args.players
+        bots.append(
+            Bot(session, args.url, username, run, stats, is_player, args.protocol)
+        )
+    try:
+        await asyncio.gather(*(bot.sign_up() for bot in bots))
+        tasks = [bot.play(args.reconnect_rate) for bot in bots[: args.players]]
+        tasks += [spectate(bot, args.reconnect_rate) for bot in bots[args.players :]]
+        await asyncio.wait_for(asyncio.gather(*tasks), args.timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        for bot in bots:
+            await bot.session.close()
+
+
+async def main(args):
+    stats = Stats()
+    prefix = "lt" + token_hex(3)  # usernames are at most 20 characters
+    sampler = None
+    if args.server_pid:
+        sampler = asyncio.ensure_future(sample_rss(args.server_pid, stats))
+    start = monotonic()
+    results = await asyncio.gather(
+        *(run_game(args, stats, prefix, i) for i in range(args.games))
+    )
+    elapsed = monotonic() - start
+    if sampler is not None:
+        sampler.cancel()
+
+    print(f"games finished:  {sum(results)}/{len(results)} in {elapsed:.1f} s")
+    print(f"messages:        {stats.messages} ({stats.messages / elapsed:.0f}/s)")
+    print(f"reconnects:      {stats.reconnects}")
+    print(f"bytes received:  {stats.bytes / len(results):.0f} per game")
+    if len(stats.latencies) >= 2:
+        percentiles = quantiles(stats.latencies, n=100)
+        print(
+            f"move->broadcast: p50 {percentiles[49] * 1000:.1f} ms, "
+            f"p99 {percentiles[98] * 1000:.1f} ms"
+        )
+    if stats.peak_rss:
+        print(f"server peak RSS: {stats.peak_rss / 1024:.1f} MB")
+    return all(results)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Load-test a running Resistance server.")
+    parser.add_argument("url", help="base URL, e.g. http://127.0.0.1:5000")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--players", type=int, default=5, choices=range(5, 11))
+    parser.add_argument("--spectators", type=int, default=2)
+    parser.add_argument(
+        "--reconnect-rate",
+        type=float,
+        default=0.01,
+        help="chance of reconnecting after each message",
+    )
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per game")
+    parser.add_argument("--server-pid", type=int, help="sample this process's RSS")
+    parser.add_argument(
+        "--protocol", default="resistance.json", choices=sorted(PROTOCOLS)
+    )
+    arguments = parser.parse_args()
+    arguments.protocol = PROTOCOLS[arguments.protocol]
+    arguments.url = arguments.url.rstrip("/")
+    raise SystemExit(0 if asyncio.run(main(arguments)) else 1)
@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import logging
+from inspect import isawaitable
+from itertools import count
+from time import monotonic
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """A pending call made by `Timers`; cancel it with `cancel()`."""
+
+    __slots__ = ("deadline", "callback", "args", "timers")
+
+    def __init__(self, deadline, callback, args, timers):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.timers = timers
+
+    def cancel(self):
+        """Stop the call from happening; does nothing once it has happened."""
+        if self.callback is not None:
+            self.callback = self.args = None
+            self.timers._cancelled(self)
+
+    @property
+    def pending(self):
+        return self.callback is not None
+
+
+class Timers:
+    """
+    Deadlines for any number of games and connections, run by one task.
+
+    Timers sit in a min-heap, so arming one is O(log n) and the task only
+    ever wakes for, and touches, the timers that are due. Cancelled timers
+    are left in the heap until they come up, unless they make up most of it,
+    in which case it's rebuilt without them.
+
+    A callback is a function (or coroutine function). Something that is
+    pushed back often, like an idle deadline, is cheapest as one timer that
+    checks when it fires whether it is still due and re-arms itself if not.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._order = count()  # breaks ties between equal deadlines
+        self._garbage = 0  # cancelled timers still in the heap
+        self._wakeup = None
+        self._task = None
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._heap) - self._garbage
+
+    def call_at(self, deadline, callback, *args):
+        """Call `callback(*args)` at the `time.monotonic()` time `deadline`."""
+        timer = Timer(deadline, callback, args, self)
+        heapq.heappush(self._heap, (deadline, next(self._order), timer))
+        if self._wakeup is not None and self._heap[0][2] is timer:
+            self._wakeup.set()  # sooner than the task is waiting for
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Call `callback(*args)` in `delay` seconds."""
+        return self.call_at(monotonic() + delay, callback, *args)
+
+    def _cancelled(self, timer):
+        self._garbage += 1
+        if self._garbage > 64 and self._garbage > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[2].pending]
+            heapq.heapify(self._heap)
+            self._garbage = 0
+
+    async def run_due(self, now):
+        """Run every timer due at or before `now`, returning how many ran."""
+        ran = 0
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[2]
+            if not timer.pending:
+                self._garbage -= 1
+                continue
+            callback, args = timer.callback, timer.args
+            timer.callback = timer.args = None  # it has happened
+            try:
+                result = callback(*args)
+                if isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Timer %r failed.", callback)
+            ran += 1
+            heap = self._heap  # a callback may have cancelled enough to rebuild it
+        self.fired += ran
+        return ran
+
+    def start(self):
+        """Start running timers as they come due. Requires a running event loop."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop running timers, leaving them in place."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = self._wakeup = None
+
+    async def _run(self):
+        while True:
+            await self.run_due(monotonic())
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class Scheduler:
+    """Run maintenance jobs periodically in the background.
+
+    A job is a function (or coroutine function) taking no arguments. Its runs
+    are counted in `metrics.MAINTENANCE_RUNS`, and if it returns a number,
+    that is added to `metrics.RECLAIMED`, both labelled with the job's name.
+    """
+
+    def __init__(self):
+        self.jobs = dict()  # name -> (interval, job)
+        self._tasks = []
+
+    def every(self, interval, job, name=None):
+        """
+        Register a job to run every `interval` seconds, replacing any job
+        registered under the same name.
+        """
+        self.jobs[name or job.__name__] = (interval, job)
+
+    def start(self):
+        """Start running every registered job. Requires a running event loop."""
+        for name, (interval, job) in self.jobs.items():
+            self._tasks.append(asyncio.ensure_future(self._run(interval, job, name)))
+
+    async def stop(self):
+        """Cancel every running job and wait for them to finish."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run(self, interval, job, name):
+        runs = metrics.MAINTENANCE_RUNS.labels(name)
+        reclaimed = metrics.RECLAIMED.labels(name)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = job()
+                if isawaitable(result):
+                    result = await result
+            except Exception:
+                logger.exception("Maintenance job %s failed.", name)
+                continue
+            runs.inc()
+            if result:
+                reclaimed.inc(result)
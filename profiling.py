@@ -0,0 +1,125 @@
+"""
+Opt-in timing spans for chosen routes and games.
+
+A root span is only started for a route or game that has been switched on
+in `PROFILER`; spans opened while it runs nest under it, and ones opened
+anywhere else are a shared no-op, so instrumented code costs one context
+variable lookup when profiling is off. Finished spans go to a ring buffer,
+which can be dumped in the collapsed-stack format that flame graph tools
+(flamegraph.pl, speedscope, ...) read.
+"""
+
+from collections import Counter, deque
+from contextvars import ContextVar
+from time import perf_counter, time
+
+_current = ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("profiler", "stack", "parent", "started", "children")
+
+    def __init__(self, profiler, stack, parent):
+        self.profiler = profiler
+        self.stack = stack
+        self.parent = parent
+        self.children = 0.0  # time spent in nested spans
+
+    def start(self):
+        self.started = perf_counter()
+        _current.set(self)
+        return self
+
+    def finish(self):
+        duration = perf_counter() - self.started
+        _current.set(self.parent)
+        if self.parent is not None:
+            self.parent.children += duration
+        self.profiler.spans.append(
+            (
+                self.stack,
+                time(),
+                duration,
+                duration - self.children,
+                self.parent is None,
+            )
+        )
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+        return False
+
+
+class _NullSpan:
+    def start(self):
+        return self
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """
+    Records spans for the routes (by endpoint) and games (by ID) switched on.
+
+    `spans` holds `(stack, finished_at, duration, self_time, is_root)` tuples
+    for the last `size` spans, newest last; stacks are `;`-separated names.
+    """
+
+    def __init__(self, size=10000):
+        self.routes = set()
+        self.games = set()
+        self.spans = deque(maxlen=size)
+
+    def request(self, endpoint):
+        """Return a root span for a request to `endpoint`, if it is profiled."""
+        if endpoint not in self.routes:
+            return NULL_SPAN
+        return Span(self, f"request {endpoint}", None)
+
+    def game(self, game_id, name):
+        """Return a root span for work on a game, if the game is profiled."""
+        if game_id not in self.games:
+            return NULL_SPAN
+        return Span(self, f"game {game_id};{name}", None)
+
+    def span(self, name, detail=None):
+        """
+        Return a span nested in the current one, or a no-op outside of one.
+
+        `detail` is appended to the name, but only formatted when recording.
+        """
+        parent = _current.get()
+        if parent is None:
+            return NULL_SPAN
+        if detail is not None:
+            name = f"{name} {detail}"
+        return Span(self, f"{parent.stack};{name}", parent)
+
+    def roots(self):
+        """Return the recorded root spans, newest first."""
+        return [span for span in reversed(self.spans) if span[4]]
+
+    def collapsed(self):
+        """Return the buffer as collapsed stacks with self time in microseconds."""
+        totals = Counter()
+        for stack, _, _, self_time, _ in self.spans:
+            totals[stack] += self_time
+        return "".join(
+            f"{stack} {round(seconds * 1e6)}\n" for stack, seconds in totals.items()
+        )
+
+
+PROFILER = Profiler()
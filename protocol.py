@@ -0,0 +1,240 @@
+"""
+Encodings of game messages on the websocket.
+
+A client picks one by the websocket subprotocol it asks for:
+
+- `resistance.json` (or none at all): the messages exactly as `Game` builds
+  them, as JSON text. Simple clients can always fall back to this.
+- `resistance.compact`: JSON with short keys and numeric message kinds, in
+  which players are referred to by their seat (their index in `game_start`'s
+  `players`) instead of by name once the game has started.
+- `resistance.msgpack`: the compact messages as MessagePack binary frames,
+  offered only if the msgpack package is installed.
+
+With either compact protocol, moves may use full or short names alike.
+Browsers also negotiate permessage-deflate with the server on their own;
+it is applied per connection on top of any of these, so it trades some CPU
+on every send for the bytes that the shared, pre-encoded frames save.
+
+`python -m benchmarks.protocols` plays some games through `Game` with each
+protocol and reports the bytes sent (with and without deflate) and encoding
+time.
+"""
+
+from json import dumps, loads
+
+try:
+    import msgpack
+except ImportError:  # optional; without it `resistance.msgpack` isn't offered
+    msgpack = None
+
+# Append-only: a kind's code is its index.
+KINDS = (
+    "lobby_update",
+    "ready_update",
+    "game_start",
+    "round_start",
+    "nomination_start",
+    "mission_nominated",
+    "nomination_vote_results",
+    "mission_start",
+    "mission_result",
+    "game_over",
+    "snapshot",
+    "estimate",
+    "catch_up",
+    "start",
+    "nominate",
+    "nomination_vote",
+    "mission_vote",
+    "ping",
+    "pong",
+)
+
+KEYS = {
+    "kind": "k",
+    "seq": "q",
+    "players": "p",
+    "num_players": "np",
+    "num_spies": "ns",
+    "agents_per_round": "a",
+    "is_player": "ip",
+    "is_spy": "is",
+    "spies": "sp",
+    "mission_size": "ms",
+    "mission_number": "mn",
+    "mission_leader": "l",
+    "vote_track": "vt",
+    "mission": "m",
+    "results": "r",
+    "approved": "ok",
+    "mission_succeeded": "s",
+    "num_fails": "f",
+    "resistance_won": "rw",
+    "lobby": "lb",
+    "waiting": "w",
+    "state": "st",
+    "game_start": "gs",
+    "round_start": "rs",
+    "last_state_change": "lc",
+    "mission_results": "mr",
+    "nomination_votes": "nv",
+    "mission_votes": "mv",
+    "estimate": "e",
+    "resistance_wins": "pw",
+    "spy_likelihood": "sl",
+    "nomination": "n",
+    "vote": "v",
+}
+
+SEAT_KEYS = frozenset(["mission_leader"])  # a player
+SEAT_LIST_KEYS = frozenset(
+    ["mission", "spies", "nomination_votes", "mission_votes", "nomination"]
+)  # lists of players
+SEAT_MAP_KEYS = frozenset(["results"])  # player -> vote, sent as a list by seat
+MESSAGE_KEYS = frozenset(["game_start", "round_start", "last_state_change", "estimate"])
+MESSAGE_LIST_KEYS = frozenset(["mission_results"])
+
+# everything a client needs to expand compact messages
+SCHEMA = {
+    "kinds": KINDS,
+    "keys": KEYS,
+    "seat": sorted(SEAT_KEYS),
+    "seat_lists": sorted(SEAT_LIST_KEYS),
+    "seat_maps": sorted(SEAT_MAP_KEYS),
+    "messages": sorted(MESSAGE_KEYS),
+    "message_lists": sorted(MESSAGE_LIST_KEYS),
+}
+
+_KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+_LONG_KEYS = {short: key for key, short in KEYS.items()}
+assert len(_LONG_KEYS) == len(KEYS) and not _LONG_KEYS.keys() & KEYS.keys()
+
+
+def compact(message, seats):
+    """Shorten a message, replacing players with their index in `seats`."""
+    out = dict()
+    for key, value in message.items():
+        if key == "kind":
+            value = _KIND_CODES.get(value, value)
+        elif key in SEAT_KEYS:
+            value = seats.get(value, value)
+        elif key in SEAT_LIST_KEYS:
+            value = [seats.get(player, player) for player in value]
+        elif key in SEAT_MAP_KEYS:
+            value = [value.get(player) for player in seats]
+        elif key in MESSAGE_KEYS:
+            value = compact(value, seats)
+        elif key in MESSAGE_LIST_KEYS:
+            value = [compact(item, seats) for item in value]
+        out[KEYS.get(key, key)] = value
+    return out
+
+
+def expand(message, players):
+    """
+    Undo `compact`, given the seating order; full-length input is unchanged.
+
+    A `game_start` in the message (or nested in a snapshot) supplies its own
+    seating order. Anything that doesn't fit is passed through for the
+    caller's usual validation.
+    """
+    if type(message) is not dict:
+        return message
+    start = message.get("gs", message)
+    if type(start) is dict and start.get("k") == _KIND_CODES["game_start"]:
+        seating = start.get("p")
+        if type(seating) is list:
+            players = seating
+    out = dict()
+    for key, value in message.items():
+        key = _LONG_KEYS.get(key, key)
+        if key == "kind":
+            if type(value) is int and 0 <= value < len(KINDS):
+                value = KINDS[value]
+        elif key in SEAT_KEYS:
+            value = _player(players, value)
+        elif key in SEAT_LIST_KEYS:
+            if type(value) is list:
+                value = [_player(players, seat) for seat in value]
+        elif key in SEAT_MAP_KEYS:
+            if type(value) is list:
+                value = dict(zip(players, value))
+        elif key in MESSAGE_KEYS:
+            value = expand(value, players)
+        elif key in MESSAGE_LIST_KEYS:
+            if type(value) is list:
+                value = [expand(item, players) for item in value]
+        out[key] = value
+    return out
+
+
+def _player(players, seat):
+    if type(seat) is int and 0 <= seat < len(players):
+        return players[seat]
+    return seat
+
+
+class Protocol:
+    """How messages are encoded for, and moves decoded from, one kind of client."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def encode(self, message, seats):
+        """Return a frame for `message`; `seats` maps players to their seat."""
+        return dumps(message)
+
+    def decode(self, data, players):
+        """Return the move in a frame, raising `ValueError` if it isn't one."""
+        return loads(data)
+
+    def __repr__(self):
+        return f"<Protocol {self.name}>"
+
+
+class CompactProtocol(Protocol):
+    def encode(self, message, seats):
+        return dumps(compact(message, seats), separators=(",", ":"))
+
+    def decode(self, data, players):
+        return self._expand(loads(data), players)
+
+    @staticmethod
+    def _expand(message, players):
+        try:
+            return expand(message, players)
+        except (TypeError, KeyError) as e:  # it parsed, but isn't a message
+            raise ValueError(str(e)) from e
+
+
+class MsgpackProtocol(CompactProtocol):
+    def encode(self, message, seats):
+        return msgpack.packb(compact(message, seats))
+
+    def decode(self, data, players):
+        if isinstance(data, str):
+            return super().decode(data, players)
+        # msgpack's errors are `ValueError`s, except for the wrong types
+        try:
+            message = msgpack.unpackb(data)
+        except TypeError as e:
+            raise ValueError(str(e)) from e
+        return self._expand(message, players)
+
+
+JSON = Protocol("resistance.json")
+COMPACT = CompactProtocol("resistance.compact")
+PROTOCOLS = {protocol.name: protocol for protocol in (JSON, COMPACT)}
+if msgpack is not None:
+    MSGPACK = MsgpackProtocol("resistance.msgpack")
+    PROTOCOLS[MSGPACK.name] = MSGPACK
+
+
+def negotiate(requested):
+    """Pick the first protocol we have from the subprotocols a client asked for."""
+    for name in requested:
+        protocol = PROTOCOLS.get(name)
+        if protocol is not None:
+            return protocol
+    return JSON
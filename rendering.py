@@ -0,0 +1,54 @@
+"""
+Cache of rendered pages.
+
+Most pages depend only on the values they are rendered with (the user's
+name, a game ID, a form error), so rendering the same template with the same
+values again is wasted work. `PageCache` keeps the most recently used
+renders along with an ETag for each, so browsers can revalidate with
+If-None-Match and get a 304 instead of the page.
+"""
+
+from collections import OrderedDict
+from hashlib import sha1
+
+from quart import render_template
+
+import metrics
+
+
+class PageCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._pages = OrderedDict()  # (template, context) -> (body, etag)
+        self._hits = metrics.CACHE_LOOKUPS.labels("pages", "hit")
+        self._misses = metrics.CACHE_LOOKUPS.labels("pages", "miss")
+
+    async def render(self, template_name, **context):
+        """
+        Return `(body, etag)` for `template_name` rendered with `context`.
+
+        The context's values must be hashable and must determine the output;
+        anything else the template reads (like `request`) isn't part of the key.
+        """
+        key = (template_name, tuple(sorted(context.items())))
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+            self._hits.inc()
+            return page
+
+        self._misses.inc()
+        body = await render_template(template_name, **context)
+        page = self._pages[key] = (body, sha1(body.encode()).hexdigest())
+        if len(self._pages) > self.max_size:
+            self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        self._pages.clear()
+
+
+def precompile(jinja_env):
+    """Load every template now, so the first request for each doesn't have to."""
+    for name in jinja_env.list_templates():
+        jinja_env.get_template(name)
@@ -1,61 +1,297 @@
 import asyncio
-from collections import defaultdict
-from functools import wraps
-from json import dumps, loads
+import os
+from argparse import ArgumentParser
+from functools import partial, wraps
+from hmac import compare_digest
+from secrets import token_hex
 from string import ascii_letters, digits
-from time import monotonic
+from time import monotonic, perf_counter
 from urllib.parse import urlparse, urlunparse
 
 from quart import (
     Quart,
     Response,
     abort,
+    g,
     make_response,
     redirect,
     render_template,
     request,
+    send_file,
     url_for,
     websocket,
 )
-from werkzeug.datastructures import Headers
 
-from game import Game
-from storage import Cookies, Users
+import metrics
+import thumbnails
+from crypt import HASH_POOL, HashingBusy, gen_salt
+from connections import (
+    RESYNC,
+    ConnectionRegistry,
+    Heartbeat,
+    SendQueue,
+    TokenBucket,
+    UserBuckets,
+)
+from directory import GameDirectory
+from engine import GameStates
+from game import MOVES, Game
+from maintenance import Scheduler, Timers
+from profiling import PROFILER
+from protocol import SCHEMA, negotiate
+from rendering import PageCache, precompile
+from sharding import ShardMap, run_workers
+from storage import (
+    AVATARS,
+    EXECUTOR,
+    EXECUTOR_THREADS,
+    POOL,
+    AsyncStorage,
+    Cookies,
+    EventLog,
+    GameEvents,
+    GameHistory,
+    LiveGames,
+    SessionCache,
+    Users,
+)
 
 VALID_USERNAME_CHARS = set(ascii_letters + digits + "_")
 
-COOKIES = Cookies()
-USERS = Users()
+COOKIES = AsyncStorage(Cookies())
+USERS = AsyncStorage(Users())
+SHARDS = ShardMap.from_environment()
+SESSIONS = SessionCache(
+    COOKIES, max_age=60 if SHARDS.sharded else None  # see other workers' log outs
+)
+LIVE_GAMES = AsyncStorage(LiveGames())
+GAME_EVENTS = AsyncStorage(GameEvents())
+EVENT_LOG = EventLog(GAME_EVENTS)
+GAME_HISTORY = AsyncStorage(GameHistory())
+
+PAGES = PageCache()
+DIRECTORY = GameDirectory()  # games being played on this worker
+MAINTENANCE = Scheduler()
+TIMERS = Timers()  # idle games, turn time limits and websocket heartbeats
+CONNECTIONS = ConnectionRegistry()  # game websockets on this worker
 
 app = Quart(__name__)
+app.config.update(
+    COOKIE_PRUNE_INTERVAL=60 * 60,  # 1 hour
+    GAME_IDLE_TIMEOUT=60 * 60 * 12,  # 12 hours
+    # seconds a phase may take before `Game.turn_timed_out` moves it along
+    TURN_TIMEOUTS=dict(
+        NOMINATING=10 * 60, VOTING_MISSION=5 * 60, RUNNING_MISSION=5 * 60
+    ),
+    EVENT_LOG_FLUSH_INTERVAL=0.2,
+    WS_SEND_QUEUE_SIZE=256,  # frames buffered per websocket before overflowing
+    WS_OVERFLOW_POLICY="resync",  # or "disconnect"; see `connections.SendQueue`
+    WS_PING_INTERVAL=30,  # ping a websocket after this many seconds of silence
+    WS_PING_TIMEOUT=30,  # and close it if there's no reply in this many
+    # Client messages over this many bytes are dropped unread. Hypercorn has
+    # already buffered them by then, up to its websocket_max_message_size.
+    WS_MAX_MESSAGE_SIZE=4096,
+    WS_MESSAGE_RATE=10,  # messages a second per connection, on average
+    WS_MESSAGE_BURST=30,
+    WS_USER_MESSAGE_RATE=20,  # and per user, over all their connections
+    WS_USER_MESSAGE_BURST=60,
+    WS_CATCH_UP_COST=5,  # messages a catch_up counts as, since it sends everything
+    PAGE_CACHE=True,  # reuse rendered pages and answer revalidations with 304s
+    ADMINS=frozenset(),  # usernames allowed on the /admin/ pages
+)
 app.games = dict()
-app.game_connections = defaultdict(set)
-app.games_playing = set()
+USER_BUCKETS = UserBuckets(
+    app.config["WS_USER_MESSAGE_RATE"], app.config["WS_USER_MESSAGE_BURST"]
+)
+app.add_template_global(SCHEMA, "compact_schema")  # for play.js
+
+IDLE_GAMES_ABORTED = metrics.RECLAIMED.labels("idle_games")
+
+metrics.Gauge("resistance_games", "Games in memory.", lambda: len(app.games))
+metrics.Gauge(
+    "resistance_games_playing",
+    "Games that have started.",
+    lambda: len(DIRECTORY),
+)
+metrics.Gauge(
+    "resistance_ws_connections",
+    "Open game websockets.",
+    lambda: len(CONNECTIONS),
+)
+metrics.Gauge(
+    "resistance_ws_queued_frames",
+    "Frames waiting in send queues.",
+    lambda: sum(queue.qsize() for queue in CONNECTIONS.queues),
+)
+metrics.Gauge(
+    "resistance_timers_pending",
+    "Idle, turn and heartbeat timers waiting to fire.",
+    lambda: len(TIMERS),
+)
+metrics.Gauge(
+    "resistance_password_hashes_pending",
+    "Password hashes queued or running.",
+    lambda: HASH_POOL.pending,
+)
+
+
+@app.before_serving
+async def restore_games():
+    """Rebuild games that were still running when the server last stopped."""
+    if SHARDS.sharded:
+        await LIVE_GAMES.remove_worker(SHARDS.me)
+    for run, game_id in await GAME_EVENTS.unfinished():
+        if not SHARDS.is_local(game_id):
+            continue  # another worker's game
+        if game_id in app.games:  # superseded by a later run
+            app.games[game_id].abort()
+        game = make_game(game_id, run)
+        await game.replay(await GAME_EVENTS.events(run))
+
+
+@app.before_serving
+async def precompile_templates():
+    precompile(app.jinja_env)
+
+
+@app.before_serving
+async def start_maintenance():
+    # each serve replaces the jobs the last one registered
+    MAINTENANCE.every(app.config["EVENT_LOG_FLUSH_INTERVAL"], EVENT_LOG.flush, "events")
+    MAINTENANCE.every(app.config["COOKIE_PRUNE_INTERVAL"], COOKIES.prune, "cookies")
+    MAINTENANCE.start()
+    TIMERS.start()
+
+
+@app.after_serving
+async def close_storage():
+    await MAINTENANCE.stop()
+    await TIMERS.stop()
+    await EVENT_LOG.flush()
+    # EXECUTOR lives as long as the process: the app may be served again
+    await POOL.close_all(EXECUTOR, EXECUTOR_THREADS)
+    HASH_POOL.shutdown()
+
+
+@app.before_request
+async def start_timer():
+    g.request_started = perf_counter()
+    g.profile_span = PROFILER.request(request.endpoint).start()
+
+
+@app.after_request
+async def count_request(response):
+    g.profile_span.finish()
+    metrics.HTTP_REQUEST_SECONDS.observe(perf_counter() - g.request_started)
+    metrics.HTTP_REQUESTS.labels(
+        request.method, request.endpoint, response.status_code
+    ).inc()
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_page():
+    return Response(metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4")
+
 
+@app.errorhandler(HashingBusy)
+async def hashing_busy(error):
+    return "The server is busy. Please try again shortly.", 503, {"Retry-After": "1"}
 
-def make_game(game_id):
+
+def make_game(game_id, run=None):
     def destroy_game():
+        idle_timer.cancel()
         app.games.pop(game_id)
-        app.game_connections[game_id].clear()
-        app.games_playing.discard(game_id)
+        CONNECTIONS.release(game_id)
+        DIRECTORY.remove(game_id)
+        if SHARDS.sharded:
+            asyncio.ensure_future(LIVE_GAMES.remove(game_id))
+        # only games played out by their players count towards their statistics
+        if game.state == GameStates.GAME_OVER and not game.timed_out:
+            engine = game.engine
+            asyncio.ensure_future(
+                GAME_HISTORY.record(
+                    run,
+                    game_id,
+                    engine.players,
+                    engine.spies,
+                    engine.mission_results,
+                    engine.resistance_won(),
+                )
+            )
 
     def list_game():
-        app.games_playing.add(game_id)
-
-    app.games[game_id] = Game(
-        app.game_connections[game_id],
+        if SHARDS.sharded:
+            asyncio.ensure_future(LIVE_GAMES.add(game_id, SHARDS.me))
+
+    def update_directory():
+        DIRECTORY.update(game_id, game.summary())
+
+    if run is None:
+        run = token_hex(8)  # game IDs get reused; runs don't
+
+    def abort_if_idle():
+        nonlocal idle_timer
+        deadline = game.last_communication + app.config["GAME_IDLE_TIMEOUT"]
+        if deadline > monotonic():
+            idle_timer = TIMERS.call_at(deadline, abort_if_idle)
+        else:
+            IDLE_GAMES_ABORTED.inc()
+            game.abort()
+
+    game = app.games[game_id] = Game(
+        CONNECTIONS.hold(game_id),
         when_finished=destroy_game,
         when_started=list_game,
+        event_log=partial(EVENT_LOG.record, run, game_id),
+        when_changed=update_directory,
+        timers=TIMERS,
+        turn_timeouts=app.config["TURN_TIMEOUTS"],
     )
-
-
-def prune_live_games():
-    to_abort = set()
-    for game_id, game in app.games.items():
-        if monotonic() - game.last_communication > 60 * 60 * 12:  # 12 hours
-            to_abort.add(game)
-    for game in to_abort:
-        game.abort()
+    idle_timer = TIMERS.call_at(
+        game.last_communication + app.config["GAME_IDLE_TIMEOUT"], abort_if_idle
+    )
+    return game
+
+
+async def check_password(username, password):
+    """Check a user's credentials, returning their true username if valid."""
+    credentials = await USERS.credentials(username)
+    if credentials is None:
+        return None
+    true_username, passwd_hash, salt = credentials
+    if compare_digest(passwd_hash, await HASH_POOL.hash_password(password, salt)):
+        return true_username
+
+
+async def render(template_name, **context):
+    with PROFILER.span("render_template", template_name):
+        return await render_template(template_name, **context)
+
+
+async def render_page(template_name, **context):
+    """
+    Render a page that depends only on `context`, reusing earlier renders.
+
+    Responses carry an ETag, and a matching If-None-Match gets a 304. With
+    `PAGE_CACHE` off, the page is rendered every time and has no ETag;
+    `python -m benchmarks.play_page` compares the two.
+    """
+    if not app.config["PAGE_CACHE"]:
+        return Response(await render(template_name, **context))
+    if app.jinja_env.auto_reload:
+        PAGES.clear()  # templates may have changed on disk
+    with PROFILER.span("render_page", template_name):
+        body, etag = await PAGES.render(template_name, **context)
+    if request.if_none_match.contains(etag):
+        response = Response("", status=304)
+    else:
+        response = Response(body)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # revalidate: the user may change
+    return response
 
 
 def relative_path(url):
@@ -68,7 +304,7 @@ def authenticated(route):
 
     @wraps(route)
     async def auth_wrapper(*args, **kwargs):
-        if "auth" in request.cookies and COOKIES.check(request.cookies["auth"]):
+        if await get_user(request) is not None:
             return await route(*args, **kwargs)
         return redirect(
             url_for(
@@ -80,26 +316,37 @@ def authenticated(route):
     return auth_wrapper
 
 
+def admin_only(route):
+    """Wrap a function that only the users in ADMINS may use."""
+
+    @wraps(route)
+    async def admin_wrapper(*args, **kwargs):
+        if await get_user(request) not in app.config["ADMINS"]:
+            abort(403)
+        return await route(*args, **kwargs)
+
+    return admin_wrapper
+
+
 @app.route("/log_in", methods=["GET"])
 async def log_in():
     values = await request.values
     dest = relative_path(values.get("dest"))  # relative_path for security
-    if "auth" in request.cookies and COOKIES.check(request.cookies["auth"]):
+    if await get_user(request) is not None:
         return redirect(dest or "/")
 
     error = ""
     if values.get("acct_created"):
         error = "Thank you for creating an account! Please log in."
 
-    COOKIES.prune()
-    return await render_template("auth.html", dest=dest, error=error)
+    return await render_page("auth.html", dest=dest, error=error)
 
 
 @app.route("/log_in", methods=["POST"])
 async def authenticate():
     values = await request.values
     dest = relative_path(values.get("dest"))  # relative_path for security
-    if "auth" in request.cookies and COOKIES.check(request.cookies["auth"]):
+    if await get_user(request) is not None:
         return redirect(relative_path(dest) or "/")
 
     if not values.get("password") and values.get("username"):
@@ -109,21 +356,21 @@ async def authenticate():
         return redirect(url_for("log_in", dest=dest))
 
     if len(values["password"]) > 1024:
-        return await render_template(
+        return await render(
             "auth.html", error="Password must be 1024 characters or shorter.", dest=dest
         )
 
-    true_username = USERS.authenticate(values["username"], values["password"])
+    true_username = await check_password(values["username"], values["password"])
     if true_username is not None:
         resp = await make_response(redirect(dest or "/"))
         resp.set_cookie(
             "auth",
-            value=COOKIES.new(true_username),
+            value=await COOKIES.new(true_username),
             max_age=int(COOKIES.VALID_LENGTH.total_seconds()),
         )
         return resp
     else:
-        return await render_template(
+        return await render(
             "auth.html", error="Unknown username or incorrect password.", dest=dest
         )
 
@@ -131,7 +378,8 @@ async def authenticate():
 @app.route("/log_out", methods=["POST"])
 async def log_out():
     if "auth" in request.cookies:
-        COOKIES.remove(request.cookies["auth"])
+        await COOKIES.remove(request.cookies["auth"])
+        SESSIONS.invalidate(request.cookies["auth"])
     response = redirect(url_for("log_in"))
     response.set_cookie("auth", "", expires=0)
     return response
@@ -140,15 +388,19 @@ async def log_out():
 def collect_websocket(func):
     @wraps(func)
     async def wrapper(game_id, *args, **kwargs):
-        queue = asyncio.Queue()
-        username = COOKIES.user(websocket.cookies.get("auth"))
-        app.game_connections[game_id].add((queue, username))
+        queue = SendQueue(
+            app.config["WS_SEND_QUEUE_SIZE"],
+            app.config["WS_OVERFLOW_POLICY"],
+            negotiate(websocket.requested_subprotocols),
+        )
+        username = await SESSIONS.user(websocket.cookies.get("auth"))
+        joined = CONNECTIONS.connect(game_id, queue, username)
         try:
-            return await func(queue, game_id, *args, **kwargs)
+            return await func(queue, game_id, joined, *args, **kwargs)
         finally:
-            app.game_connections[game_id].discard((queue, username))
+            left = CONNECTIONS.disconnect(game_id, queue)
             game = app.games.get(game_id)
-            if game is not None:
+            if left and game is not None:
                 await game.discard(username)
 
     return wrapper
@@ -156,12 +408,39 @@ def collect_websocket(func):
 
 @app.route("/profilepic/<string:user>", methods=["GET"])
 async def profilepic(user):
-    img_blob, img_mimetype = USERS.profile_pic(user)
-    if img_blob is None:
+    digest, _ = await USERS.profile_pic(user)
+    if digest is None:
         return redirect(url_for("static", filename="img/profile-default.png"))
-    headers = Headers()
-    headers.add("Content-Disposition", "inline", filename=user)
-    return Response(img_blob, mimetype=img_mimetype, headers=headers)
+    size = request.args.get("size", type=int)
+    if size not in thumbnails.SIZES:
+        size = max(thumbnails.SIZES)
+    # only renditions are served: originals may carry EXIF data, like a location
+    rendition = AVATARS.rendition_name(digest, size)
+    if AVATARS.path(rendition) is None:  # couldn't be decoded to make renditions
+        return redirect(url_for("static", filename="img/profile-default.png"))
+    response = redirect(url_for("avatar", filename=rendition))
+    response.cache_control.no_cache = True  # the avatar itself is cached forever
+    return response
+
+
+@app.route("/avatar/<string:filename>", methods=["GET"])
+async def avatar(filename):
+    # Only renditions are stored under a name with an extension, and only
+    # under their real type's, so originals and wrong types aren't found.
+    mimetype = AVATARS.mimetype(filename)
+    path = AVATARS.path(filename)
+    if mimetype is None or path is None:
+        abort(404, "That avatar doesn't exist.")
+    etag = filename.partition(".")[0]
+    if request.if_none_match.contains(etag):
+        response = Response("", status=304)
+    else:
+        response = await send_file(path, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 60 * 60 * 24 * 365  # 1 year
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route("/reptilepic/<int:number>", methods=["GET"])
@@ -174,29 +453,39 @@ async def reptile_pic(number):
 @app.route("/profile/me/", methods=["GET"])
 @authenticated
 async def my_profile():
-    return await render_template("profile.html", user=get_user(request))
+    user = await get_user(request)
+    return await render_page(
+        "profile.html", user=user, stats=await GAME_HISTORY.stats(user)
+    )
 
 
 @app.route("/profile/me/", methods=["POST"])
 @authenticated
 async def upload_profile():
-    user = get_user(request)
+    user = await get_user(request)
     files = await request.files
     new_picture = files.get("profile-picture")
     if new_picture is None:
-        return await render_template(
+        return await render(
             "profile.html", user=user, picture_error="Please provide an image."
         )
     if not check_filetype(new_picture, ("image/jpeg", "image/png", "image/gif")):
-        return await render_template(
+        return await render(
             "profile.html", user=user, picture_error="Invalid image type."
         )
     img_blob = new_picture.read(2_000_000)  # base-10 2 MB
     if new_picture.read(1):  # not at end of file
-        return await render_template(
+        return await render(
             "profile.html", user=user, picture_error="Image is too large."
         )
-    USERS.set_profile(user, img_blob, new_picture.content_type)
+    loop = asyncio.get_running_loop()
+    try:
+        renditions = await loop.run_in_executor(
+            None, thumbnails.make_renditions, img_blob
+        )
+    except thumbnails.InvalidImage:
+        return await render("profile.html", user=user, picture_error="Invalid image.")
+    await USERS.set_profile(user, img_blob, new_picture.content_type, renditions)
     return redirect(url_for("my_profile"))
 
 
@@ -208,49 +497,115 @@ def check_filetype(some_file, allowed_file_types):
 @app.route("/profile/me/change_password", methods=["POST"])
 @authenticated
 async def change_password():
-    user = get_user(request)
+    user = await get_user(request)
     values = await request.values
     old_password = values.get("old_password")
     new_password = values.get("new_password")
     if not (old_password and new_password):
         return redirect(url_for("my_profile"))
-    if USERS.authenticate(user, old_password) is not None:
-        USERS.change_password(user, new_password)
+    if await check_password(user, old_password) is not None:
+        _, _, salt = await USERS.credentials(user)
+        new_hash = await HASH_POOL.hash_password(new_password, salt)
+        await USERS.change_password(user, new_hash)
     return redirect(url_for("my_profile"))
 
 
 @app.websocket("/play/<int:game_id>/ws")
 @collect_websocket
-async def ws(queue, game_id):
-    game = app.games.get(game_id)
+async def ws(queue, game_id, joined):
+    game = app.games.get(game_id)  # None if another worker owns the game
     if game is None:
         return
 
-    player_id = COOKIES.user(websocket.cookies.get("auth"))
+    player_id = await SESSIONS.user(websocket.cookies.get("auth"))
 
     if not game.can_join(player_id):
         return
-    await game.join(player_id)
+    protocol = queue.protocol
+    if protocol.name in websocket.requested_subprotocols:
+        await websocket.accept(subprotocol=protocol.name)
+    if joined:  # not just another tab
+        await game.join(player_id)
+    heartbeat = Heartbeat(
+        queue, TIMERS, app.config["WS_PING_INTERVAL"], app.config["WS_PING_TIMEOUT"]
+    )
+    bucket = TokenBucket(app.config["WS_MESSAGE_RATE"], app.config["WS_MESSAGE_BURST"])
+    # anonymous connections aren't one user, so don't share a bucket
+    user_key = queue if player_id is None else player_id
+    user_bucket = USER_BUCKETS.open(user_key)
+    max_size = app.config["WS_MAX_MESSAGE_SIZE"]
+    catch_up_cost = app.config["WS_CATCH_UP_COST"]
+
+    def drop(reason):
+        metrics.WS_MESSAGES_DROPPED.labels(reason).inc()
+
+    def spend(tokens):
+        """Take `tokens` from both buckets, or from neither if either is short."""
+        if not bucket.has(tokens):
+            drop("rate_limited")
+            return False
+        if not user_bucket.has(tokens):
+            drop("user_rate_limited")
+            return False
+        bucket.take(tokens)
+        user_bucket.take(tokens)
+        return True
 
     async def consumer():
         while True:
             data = await websocket.receive()
-            try:
-                move = loads(data)
-            except ValueError:
+            heartbeat.heard()
+            metrics.WS_MESSAGES.inc()
+            # cheapest checks first: nothing below is done for a dropped message
+            # in characters first, so that a huge text frame isn't encoded
+            if len(data) > max_size or (
+                type(data) is str and len(data.encode()) > max_size
+            ):
+                drop("too_large")
+                continue
+            if not spend(1):
                 continue
-            await game.player_move(player_id, move, queue)
+            with PROFILER.game(game_id, "move"):
+                try:
+                    with PROFILER.span("decode"):
+                        move = protocol.decode(data, game.players)
+                except Exception:  # not only ValueError: deep nesting recurses
+                    drop("malformed")
+                    continue
+                kind = move.get("kind") if type(move) is dict else None
+                if kind == "pong":
+                    continue  # only for `heartbeat`; not activity in the game
+                if type(kind) is not str or kind not in MOVES:
+                    drop("unknown_kind")
+                    continue
+                if kind == "catch_up" and not spend(catch_up_cost - 1):
+                    continue
+                await game.player_move(player_id, move, queue)
 
     async def producer():
         while True:
-            data = await queue.get()
-            await websocket.send(dumps(data))
+            frame = await queue.get()  # already encoded by `Game`
+            if frame is SendQueue.CLOSE:
+                return  # too slow to keep up, or not answering pings
+            if frame is SendQueue.CATCH_UP:
+                with PROFILER.game(game_id, "resync"):
+                    await game.catch_up(player_id, queue)
+                continue
+            with PROFILER.game(game_id, "send"):
+                await websocket.send(frame)
+            metrics.WS_FRAMES_SENT.inc()
 
     consumer_task = asyncio.ensure_future(consumer())
     producer_task = asyncio.ensure_future(producer())
     try:
-        await asyncio.gather(consumer_task, producer_task)
+        done, _ = await asyncio.wait(
+            (consumer_task, producer_task), return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            task.result()  # propagate errors
     finally:
+        heartbeat.stop()
+        USER_BUCKETS.close(user_key)
         consumer_task.cancel()
         producer_task.cancel()
 
@@ -258,18 +613,18 @@ async def ws(queue, game_id):
 @app.route("/play/<int:game_id>/")
 @authenticated
 async def play(game_id):
-    prune_live_games()
+    if not SHARDS.is_local(game_id):
+        return redirect(SHARDS.url(game_id, url_for("play", game_id=game_id)))
 
     if game_id not in app.games:
         make_game(game_id)
 
-    return await render_template("play.html", user=get_user(request), game_id=game_id)
+    return await render_page("play.html", user=await get_user(request), game_id=game_id)
 
 
-def get_user(req):
-    auth = req.cookies.get("auth")
-    if auth is not None:
-        return COOKIES.user(auth)
+async def get_user(req):
+    with PROFILER.span("get_user"):
+        return await SESSIONS.user(req.cookies.get("auth"))
 
 
 @app.route("/play/", methods=["GET"])
@@ -287,7 +642,86 @@ async def go_to_game():
 
 @app.route("/live_games/", methods=["GET"])
 async def live_games():
-    return await render_template("live_games.html", games=app.games_playing)
+    if SHARDS.sharded:  # other workers' games aren't in DIRECTORY
+        games = tuple(sorted(await LIVE_GAMES.game_ids()))
+    else:
+        games = None  # the page subscribes to `live_games_stream` instead
+    return await render_page("live_games.html", games=games)
+
+
+@app.route("/live_games/stream", methods=["GET"])
+async def live_games_stream():
+    """Stream DIRECTORY as server-sent events: a snapshot, then each change."""
+    queue = SendQueue(app.config["WS_SEND_QUEUE_SIZE"], RESYNC)
+    DIRECTORY.subscribe(queue)
+
+    async def events():
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is SendQueue.CATCH_UP:
+                    frame = DIRECTORY.snapshot()
+                yield f"data: {frame}\n\n".encode()
+        finally:
+            DIRECTORY.unsubscribe(queue)
+
+    response = await make_response(
+        events(), {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    )
+    response.timeout = None  # the stream stays open
+    return response
+
+
+@app.route("/admin/profile", methods=["GET"])
+@authenticated
+@admin_only
+async def admin_profile():
+    return await render(
+        "admin_profile.html",
+        user=await get_user(request),
+        profiler=PROFILER,
+        endpoints=sorted(set(rule.endpoint for rule in app.url_map.iter_rules())),
+        roots=PROFILER.roots()[:200],
+    )
+
+
+@app.route("/admin/profile", methods=["POST"])
+@authenticated
+@admin_only
+async def toggle_profiling():
+    values = await request.values
+    if "route" in values:
+        targets, target = PROFILER.routes, values["route"]
+    else:
+        targets, target = PROFILER.games, values.get("game_id", type=int)
+    if target is not None:
+        if values.get("enable"):
+            targets.add(target)
+        else:
+            targets.discard(target)
+    if values.get("clear"):
+        PROFILER.spans.clear()
+    return redirect(url_for("admin_profile"))
+
+
+@app.route("/admin/profile.folded", methods=["GET"])
+@authenticated
+@admin_only
+async def profile_dump():
+    return Response(
+        PROFILER.collapsed(),
+        content_type="text/plain",
+        headers={"Content-Disposition": "attachment; filename=profile.folded"},
+    )
+
+
+@app.route("/leaderboard/", methods=["GET"])
+async def leaderboard():
+    return await render_page(
+        "leaderboard.html",
+        user=await get_user(request),
+        leaders=tuple(await GAME_HISTORY.leaderboard()),
+    )
 
 
 @app.route("/sign_up", methods=["POST"])
@@ -301,47 +735,70 @@ async def register():
         return redirect(url_for("sign_up", dest=dest))
 
     if not all(c in VALID_USERNAME_CHARS for c in values["username"]):
-        return await render_template(
+        return await render(
             "register.html",
             error="Characters in username can be only letters, numbers, and underscore.",
             dest=dest,
         )
 
     if len(values["username"]) > 20:
-        return await render_template(
+        return await render(
             "register.html",
             error="Username must be shorter than 20 characters.",
             dest=dest,
         )
 
     if len(values["password"]) > 1024:
-        return await render_template(
+        return await render(
             "register.html",
             error="Password must be 1024 characters or shorter.",
             dest=dest,
         )
 
-    error = USERS.register(values["username"], values["password"])
+    salt = gen_salt()
+    passwd_hash = await HASH_POOL.hash_password(values["password"], salt)
+    error = await USERS.register(values["username"], passwd_hash, salt)
     if error is None:
         return redirect(url_for("log_in", acct_created=True, dest=dest))
     else:
-        return await render_template("register.html", error=error, dest=dest)
+        return await render("register.html", error=error, dest=dest)
 
 
 @app.route("/sign_up", methods=["GET"])
 async def sign_up():
     values = await request.values
     dest = relative_path(values.get("dest"))  # relative_path for security
-    if "auth" in request.cookies and COOKIES.check(request.cookies["auth"]):
+    if await get_user(request) is not None:
         return redirect(dest or "/")
-    return await render_template("register.html", dest=dest)
+    return await render_page("register.html", dest=dest)
 
 
 @app.route("/", methods=["GET"])
 async def index():
-    prune_live_games()
-    return await render_template("index.html", user=get_user(request))
+    return await render_page("index.html", user=await get_user(request))
 
 
 if __name__ == "__main__":
-    app.run()
+    parser = ArgumentParser(description="Run the Resistance server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="run this many processes on consecutive ports, sharing games between them",
+    )
+    parser.add_argument(
+        "--public-url",
+        default=os.environ.get("RESISTANCE_PUBLIC_URL"),
+        help="where browsers reach each worker, with {port} or {index} filled in, "
+        "e.g. https://example.com:{port} (default: http://HOST:{port})",
+    )
+    args = parser.parse_args()
+    if args.workers > 1:
+        try:
+            run_workers(__file__, args.workers, args.host, args.port, args.public_url)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        app.run(host=args.host, port=args.port)
@@ -0,0 +1,108 @@
+"""
+Run several server processes, each owning a share of the games.
+
+Workers are listed, in the same order for every process, in the
+`RESISTANCE_WORKERS` environment variable as comma-separated base URLs, and
+each process finds itself by `RESISTANCE_WORKER`. These are the public URLs
+browsers are redirected to, which may differ from the address a worker
+binds to, e.g. behind a proxy or when binding to 0.0.0.0. Game IDs are assigned to
+workers by rendezvous hashing, so adding or removing a worker only moves the
+games that worker gains or loses. Without those variables there is a single
+worker that owns everything.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+from hashlib import sha1
+
+
+class ShardMap:
+    """Decide which worker owns each game."""
+
+    def __init__(self, workers=(), me=None):
+        self.workers = tuple(workers)
+        self.me = me
+        if self.workers and me not in self.workers:
+            raise ValueError("This worker ({!r}) isn't in the worker list.".format(me))
+
+    @classmethod
+    def from_environment(cls):
+        workers = os.environ.get("RESISTANCE_WORKERS")
+        if not workers:
+            return cls()
+        return cls(workers.split(","), os.environ.get("RESISTANCE_WORKER"))
+
+    @property
+    def sharded(self):
+        return len(self.workers) > 1
+
+    def owner(self, game_id):
+        """Return the base URL of the worker that owns a game."""
+        if not self.workers:
+            return self.me
+        return max(
+            self.workers,
+            key=lambda worker: sha1(f"{worker}/{game_id}".encode()).digest(),
+        )
+
+    def is_local(self, game_id):
+        return not self.sharded or self.owner(game_id) == self.me
+
+    def url(self, game_id, path):
+        """
+        Return an absolute URL for `path` on the worker that owns a game.
+
+        `path` is appended to the worker's base URL, keeping any path prefix
+        that a proxy routes to that worker.
+        """
+        return self.owner(game_id).rstrip("/") + "/" + path.lstrip("/")
+
+
+WILDCARD_HOSTS = ("", "0.0.0.0", "::")
+
+
+def worker_urls(count, host="127.0.0.1", base_port=5000, public_url=None):
+    """
+    Return the public base URLs of `count` workers on consecutive ports.
+
+    `public_url` is a template for them, e.g. "https://example.com:{port}" or
+    "https://example.com/worker{index}/". Without it workers are reached at
+    the address they bind to, which needs a host that browsers can reach.
+    """
+    if public_url is None:
+        if host in WILDCARD_HOSTS:
+            raise ValueError(
+                f"Browsers can't be sent to {host!r}; give the workers a public URL."
+            )
+        public_url = f"http://{host}:{{port}}"
+    return [public_url.format(index=i, port=base_port + i) for i in range(count)]
+
+
+def run_workers(script, count, host="127.0.0.1", base_port=5000, public_url=None):
+    """
+    Start `count` workers of `script` on consecutive ports and wait for them.
+
+    `public_url` is passed on to `worker_urls`.
+    """
+    workers = worker_urls(count, host, base_port, public_url)
+    processes = []
+    for i, worker in enumerate(workers):
+        env = dict(
+            os.environ, RESISTANCE_WORKERS=",".join(workers), RESISTANCE_WORKER=worker
+        )
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, script, "--host", host, "--port", str(base_port + i)],
+                env=env,
+            )
+        )
+    # make `terminate` of this process reach the `finally` below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for process in processes:
+            process.wait()
+    finally:
+        for process in processes:
+            process.terminate()
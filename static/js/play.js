@@ -0,0 +1,623 @@
+// per-user values and URLs, from the page's bootstrap script
+const user = BOOTSTRAP.user;
+const URLS = BOOTSTRAP.urls;
+const alert_sound = new Audio(URLS.alertSound);
+let players = [];
+let missionSize = -1;
+let is_player = false;
+let player_ready = false;
+
+let lobbySize = -1;
+
+let lastSeq = -1;  // sequence number of the last update applied
+let replaying = false;  // applying a snapshot: skip pop-ups
+
+const reptiles = URLS.reptiles.slice();
+
+// prefer the compact protocol (see protocol.py), falling back to plain JSON
+const socket = new WebSocket(BOOTSTRAP.socket, ["resistance.compact", "resistance.json"]);
+const COMPACT = BOOTSTRAP.protocol;
+const LONG_KEYS = Object.fromEntries(Object.entries(COMPACT.keys).map(([key, short]) => [short, key]));
+const GAME_START = COMPACT.kinds.indexOf("game_start");
+let seating = [];  // players by seat, which compact messages refer to them by
+
+const HANDLERS = {
+    "game_start": game_start,
+    "round_start": round_start,
+    "mission_nominated": mission_nominated,
+    "nomination_vote_results": nomination_vote_results,
+    "mission_start": mission_start,
+    "mission_result": mission_result,
+    "game_over": game_over,
+    "nomination_start": nomination_start,
+    "lobby_update": lobby_update,
+    "ready_update": ready_update,
+    "snapshot": snapshot,
+    "estimate": estimate,
+    "ping": () => send({"kind": "pong"}),
+};
+
+function game_start(update) {
+    document.getElementById("num_players").innerText = update.num_players;
+    document.getElementById("num_spies").innerText = update.num_spies;
+    document.getElementById("player_makeup").style.display = "block";
+
+    for (let i = 0; i < 5; i++) {
+        document.getElementById(missionsize_id(i)).innerText = update.agents_per_round[i];
+    }
+
+    if (update.num_players >= 7) {
+        document.getElementById("two_fails_required").style.display = "block";
+    }
+
+    players = update.players;
+
+    set_players(update.players);
+
+    if (update.is_player) {
+        is_player = true;
+
+        const alignment = document.getElementById("alignment");
+        alignment.textContent = '';
+        if (update.is_spy) {
+            alignment.appendChild(document.createTextNode("You are a\u00A0"));
+            const bold = document.createElement("b");
+            bold.innerText = "Reptilian";
+            bold.style.color = "var(--spies-deep)";
+            alignment.appendChild(bold);
+            alignment.appendChild(document.createTextNode(`! The Reptilians are ${list(update.spies)}.`));
+
+            update.spies.forEach(spy => document.getElementById(nameplate_id(spy)).style.background = "var(--spies-light)");
+        } else {
+            alignment.appendChild(document.createTextNode("You are\u00A0"));
+            const bold = document.createElement("b");
+            bold.innerText = "Human";
+            bold.style.color = "var(--resistance-deep)";
+            alignment.appendChild(bold);
+            alignment.appendChild(document.createTextNode("."));
+        }
+
+        if (!replaying) {
+            const gameModal = $('#gameModal');
+            document.getElementById("gameModalTitle").innerText = "Game starting";
+            document.getElementById("gameModalBody").appendChild(alignment.cloneNode(true));
+            gameModal.modal()
+        }
+    }
+}
+
+function snapshot(update) {
+    replaying = true;
+    if (update.lobby !== undefined) {  // not started, or aborted before it was
+        lobby_update({"players": update.lobby});
+        if (update.waiting.length < update.lobby.length) {
+            ready_update({"waiting": update.waiting});
+        }
+    } else {
+        Array.from(document.getElementsByClassName("currentVoteTrack")).forEach(track =>
+            track.classList.remove("currentVoteTrack"));
+        game_start(update.game_start);
+        update.mission_results.forEach(mission_result);
+        round_start(update.round_start);
+        const handler = HANDLERS[update.last_state_change.kind];
+        if (handler !== undefined) {
+            handler(update.last_state_change);
+        }
+        if (update.state === "VOTING_MISSION" && update.nomination_votes.indexOf(user) >= 0) {
+            document.getElementById('voteStatus').innerText = "You have voted on this mission.";
+        }
+        if (update.state === "RUNNING_MISSION" && update.mission_votes.indexOf(user) >= 0) {
+            document.getElementById('missionStatus').innerText = "You have made your choice.";
+        }
+        if (update.estimate !== undefined) {
+            estimate(update.estimate);
+        }
+    }
+    replaying = false;
+}
+
+// only spectators are sent these
+function estimate(update) {
+    const estimateText = document.getElementById("estimate");
+    estimateText.innerText = `Chance the Humans win: ${Math.round(update.resistance_wins * 100)}%`;
+    estimateText.style.display = "block";
+
+    players.forEach((player, seat) => {
+        const nameplate = document.getElementById(nameplate_id(player));
+        nameplate.getElementsByClassName("spyLikelihood")[0].innerText =
+            `${Math.round(update.spy_likelihood[seat] * 100)}% Reptilian`;
+    });
+}
+
+function lobby_update(update) {
+    set_players(update.players);
+    lobbySize = update.players.length;
+
+    const startButton = document.getElementById('startGameButton');
+    if (!player_ready) {
+        startButton.disabled = lobbySize < 5 || lobbySize > 10;
+    }
+}
+
+function ready_update(update) {
+    const startButton = document.getElementById('startGameButton');
+    const waitingText = document.getElementById('waitingText');
+
+    waitingText.innerText = `Waiting on ${list(update.waiting)}…`;
+    player_ready = (update.waiting.indexOf(user) === -1);
+    startButton.disabled = player_ready;  // disable if we're ready
+}
+
+const PROFILE_PICTURE_URL = URLS.profilePicture;
+
+function set_players(plyrs) {
+    const playersDiv = document.getElementById("players");
+    playersDiv.textContent = '';
+    plyrs.forEach(player => {
+        const col = document.createElement("div");
+        col.classList.add("col");
+        col.classList.add("justify-content-center");
+        col.classList.add("namePlate");
+        col.id = nameplate_id(player);
+
+        const pfpDiv = document.createElement("div");
+        pfpDiv.classList.add("pfp-div");
+
+        const profileImage = document.createElement("img");
+        profileImage.src = PROFILE_PICTURE_URL.replace('PLACEHOLDER', player);
+        profileImage.classList.add("pfp-img");
+        pfpDiv.appendChild(profileImage);
+        col.appendChild(pfpDiv);
+
+        const nameSpan = document.createElement("span");
+        nameSpan.innerText = player;
+        col.appendChild(nameSpan);
+
+        col.appendChild(document.createElement("br"));
+
+        const likelihoodSpan = document.createElement("small");
+        likelihoodSpan.classList.add("spyLikelihood");
+        col.appendChild(likelihoodSpan);
+
+        col.appendChild(token_image(URLS.leader, "Mission leader", ["leaderToken"]));
+        col.appendChild(token_image(URLS.gun, "Mission nominee", ["gunToken"]));
+
+        playersDiv.appendChild(col);
+    });
+}
+
+function round_start(update) {
+    document.getElementById(mission_id(update.mission_number)).classList.add("active");
+    missionSize = update.mission_size;
+}
+
+function nomination_start(update) {
+    document.getElementById(votetrack_id(update.vote_track)).classList.add("currentVoteTrack");
+
+    setTokens("leaderToken", [update.mission_leader]);
+
+    const currentStatus = document.getElementById('currentStatus');
+    currentStatus.textContent = '';
+    if (user === update.mission_leader) {
+        currentStatus.appendChild(
+            document.createTextNode("You are the mission leader! Select your mission:")
+        );
+
+        const usersList = document.createElement("ul");
+        usersList.id = "nominationList";
+        players.forEach(player => {
+            const row = document.createElement("li");
+            const checkbox = document.createElement("input");
+            checkbox.type = "checkbox";
+            checkbox.name = player;
+            checkbox.checked = player === user;
+            row.appendChild(checkbox);
+            row.appendChild(document.createTextNode(player));
+            usersList.appendChild(row);
+        });
+        currentStatus.appendChild(usersList);
+
+        const submitNomButton = document.createElement("button");
+        submitNomButton.onclick = submit_nomination;
+        submitNomButton.classList.add("btn");
+        submitNomButton.classList.add("btn-outline-primary");
+        submitNomButton.innerText = "Nominate";
+        currentStatus.appendChild(submitNomButton);
+
+        currentStatus.appendChild(document.createElement("br"));
+
+        const nominationErrorText = document.createElement("span");
+        nominationErrorText.id = "nominationErrorText";
+        currentStatus.appendChild(nominationErrorText)
+
+        alert_sound.play();
+    } else {
+        currentStatus.innerText = `${update.mission_leader} is nominating a mission.`;
+    }
+}
+
+function mission_nominated(update) {
+    const currentStatus = document.getElementById('currentStatus');
+    currentStatus.textContent = '';
+
+    setTokens("gunToken", update.mission);
+    setTokens("leaderToken", [update.mission_leader]);
+
+    currentStatus.appendChild(document.createTextNode(`${update.mission_leader} has nominated the following mission:`));
+    const mission = document.createElement("ol");
+    update.mission.forEach(agent => {
+        const li = document.createElement("li");
+        li.innerText = agent;
+        mission.appendChild(li);
+    });
+    currentStatus.appendChild(mission);
+
+    if (is_player) {
+        currentStatus.appendChild(document.createTextNode("Do you approve of this mission?"));
+
+        currentStatus.appendChild(document.createElement("br"));
+
+        const approveButton = document.createElement("button");
+        approveButton.innerText = "Approve";
+        approveButton.onclick = () => nomination_vote(true);
+        approveButton.classList.add("btn");
+        approveButton.classList.add("btn-info");
+        currentStatus.appendChild(approveButton);
+
+        const rejectButton = document.createElement("button");
+        rejectButton.innerText = "Reject";
+        rejectButton.onclick = () => nomination_vote(false);
+        rejectButton.classList.add("btn");
+        rejectButton.classList.add("btn-dark");
+        currentStatus.appendChild(rejectButton);
+
+        currentStatus.appendChild(document.createElement("br"));
+
+        const voteStatus = document.createElement("span");
+        voteStatus.id = "voteStatus";
+        currentStatus.appendChild(voteStatus);
+
+        alert_sound.play();
+    }
+}
+
+function nomination_vote_results(update) {
+    document.getElementById(votetrack_id(update.vote_track)).classList.remove("currentVoteTrack");
+
+    if (!update.approved) {
+        clearTokens("gunToken");
+    }
+
+    const results = document.createElement("p");
+    results.appendChild(document.createTextNode("The results are in! The mission nominated was"));
+
+    const lst = document.createElement("ol");
+    update.mission.forEach(agent => {
+        const li = document.createElement("li");
+        li.innerText = agent;
+        lst.appendChild(li);
+    });
+    results.appendChild(lst);
+
+    results.appendChild(document.createTextNode("and the votes were"));
+
+    const table = document.createElement("table");
+    {
+        const headerRow = document.createElement("tr");
+        const approved = document.createElement("th");
+        approved.innerText = "Approved";
+        const rejected = document.createElement("th");
+        rejected.innerText = "Rejected";
+        headerRow.appendChild(approved);
+        headerRow.appendChild(rejected);
+        table.appendChild(headerRow);
+    }
+    {
+        const row = document.createElement("tr");
+        const approved = document.createElement("td");
+        const rejected = document.createElement("td");
+
+        for (const [name, voted_yes] of Object.entries(update.results)) {
+            if (voted_yes) {
+                approved.appendChild(document.createTextNode(name));
+                approved.appendChild(document.createElement("br"))
+            } else {
+                rejected.appendChild(document.createTextNode(name));
+                rejected.appendChild(document.createElement("br"))
+            }
+        }
+        row.appendChild(approved);
+        row.appendChild(rejected);
+
+        table.appendChild(row);
+    }
+
+    results.appendChild(table);
+    results.appendChild(document.createTextNode(`The mission was ${update.approved ? "approved" : "rejected"}.`));
+
+    const gameModal = $('#gameModal');
+    document.getElementById("gameModalTitle").innerText = "Nomination vote results";
+    document.getElementById("gameModalBody").textContent = '';
+    document.getElementById("gameModalBody").appendChild(results);
+    gameModal.modal()
+}
+
+function mission_start(update) {
+    setTokens("gunToken", update.mission);
+    setTokens("leaderToken", [update.mission_leader]);
+
+    const currentStatus = document.getElementById('currentStatus');
+    currentStatus.textContent = '';
+    if (update.mission.indexOf(user) >= 0) {
+        currentStatus.appendChild(document.createTextNode("You're going on a mission! What do you do?"));
+
+        currentStatus.appendChild(document.createElement("br"));
+
+        const pass = document.createElement("button");
+        pass.innerText = "Pass";
+        pass.onclick = () => mission_vote(true);
+        pass.classList.add("btn");
+        pass.classList.add("btn-info");
+        currentStatus.appendChild(pass);
+
+        const fail = document.createElement("button");
+        fail.innerText = "Fail";
+        fail.onclick = () => mission_vote(false);
+        fail.classList.add("btn");
+        fail.classList.add("btn-dark");
+        currentStatus.appendChild(fail);
+
+        currentStatus.appendChild(document.createElement("br"));
+
+        const missionStatus = document.createElement("span");
+        missionStatus.id = "missionStatus";
+        currentStatus.appendChild(missionStatus);
+
+        alert_sound.play();
+    } else {
+        currentStatus.innerText = `A mission is occurring with ${list(update.mission)}.`
+    }
+}
+
+function mission_result(update) {
+    document.getElementById(mission_id(update.mission_number)).classList.remove("active");
+    document.getElementById(mission_id(update.mission_number)).classList.add(update.mission_succeeded ? "passed" : "failed");
+
+    if (update.num_fails > 0) {
+        document.getElementById(results_id(update.mission_number)).innerText =
+            `(${update.num_fails} fail${update.num_fails > 1 ? 's' : ''})`;
+    }
+
+    clearTokens("gunToken");
+
+    if (replaying) {
+        return;
+    }
+
+    const results = document.createElement("p");
+    results.innerText = `The mission ${update.mission_succeeded ? "passed" : "failed"
+    }${update.num_fails > 0 ? ` with ${update.num_fails} fail${update.num_fails > 1 ? "s" : ""}` : ""}.`;
+
+    const gameModal = $('#gameModal');
+    document.getElementById("gameModalTitle").innerText = "Mission results";
+    document.getElementById("gameModalBody").textContent = '';
+    document.getElementById("gameModalBody").appendChild(results);
+    gameModal.modal()
+}
+
+function game_over(update) {
+    const currentStatus = document.getElementById("currentStatus");
+    document.getElementById("estimate").style.display = "none";
+
+    const gameModal = $('#gameModal');
+    gameModal.on('hidden.bs.modal', function (e) {
+        clearTokens("leaderToken");
+
+        currentStatus.textContent = '';
+        if (update.resistance_won) {
+            const resistance = [];
+            players.forEach(player => {
+                if (update.spies.indexOf(player) < 0) resistance.push(player)
+            });
+            currentStatus.innerText = `The human race will live on for now, thanks to ${list(resistance)}.`;
+        } else {
+            currentStatus.innerText = `Bow down to your new Reptilian overlords: ${list(update.spies)}!`;
+        }
+
+        Array.from(document.getElementsByClassName("namePlate")).forEach(namePlate => {
+            const name = namePlate.getElementsByTagName("span")[0].innerText.trim();
+            const is_spy = update.spies.indexOf(name) >= 0;
+            namePlate.style.background = is_spy ? "var(--spies)" : "var(--resistance)";
+            if (is_spy) {
+                namePlate.getElementsByClassName("pfp-img")[0].src = get_reptile();
+            }
+        });
+
+        gameModal.off();
+
+        const img = document.createElement("img");
+        img.style.width = "100%";
+        img.src = update.resistance_won ? URLS.humanVictory : URLS.reptilianVictory;
+
+        document.getElementById("gameModalTitle").innerText = "Game over";
+        const gameModalBody = document.getElementById("gameModalBody");
+        gameModalBody.textContent = '';
+        gameModalBody.appendChild(currentStatus.cloneNode(true));
+        gameModalBody.appendChild(img);
+        gameModal.modal()
+    });
+
+    socket.onclose = () => {
+    };
+    socket.close();
+}
+
+function get_reptile() {
+    const index = Math.floor(Math.random() * reptiles.length);
+    const reptile = reptiles[index];
+    reptiles.splice(index, 1);
+    return reptile;
+}
+
+function start_game() {
+    if (lobbySize > 10 || lobbySize < 5) {
+        document.getElementById("startError").innerText = `Cannot start with ${lobbySize} players: need 5–10 players.`;
+    } else {
+        send({"kind": "start"});
+    }
+}
+
+function token_image(src, alt_text, class_list = []) {
+    const img = document.createElement("img");
+    img.src = src;
+    img.alt = alt_text;
+    img.title = alt_text;
+    img.style.display = "none";
+    img.style.height = "40px";
+    class_list.forEach(klass => img.classList.add(klass));
+    return img;
+}
+
+function clearTokens(kind) {
+    Array.from(document.getElementsByClassName(kind)).forEach(token =>
+        token.style.display = "none");
+}
+
+function setTokens(kind, who) {
+    clearTokens(kind);
+
+    who.forEach(agent => {
+        const nameplate = document.getElementById(nameplate_id(agent));
+        nameplate.getElementsByClassName(kind)[0].style.display = "inline";
+    });
+}
+
+function submit_nomination() {
+    const nomination = [];
+
+    const nominationList = document.getElementById("nominationList");
+    for (let i = 0; i < nominationList.children.length; i++) {
+        const nomRow = nominationList.children[i];
+        const checkbox = nomRow.children[0];
+        if (checkbox.checked) {
+            nomination.push(checkbox.name);
+        }
+    }
+
+    if (nomination.length !== missionSize) {
+        document.getElementById("nominationErrorText").innerText =
+            `Wrong size mission! You have ${nomination.length} participants but you should have ${missionSize}.`;
+    } else {
+        send({'kind': 'nominate', 'nomination': nomination});
+    }
+}
+
+function nomination_vote(vote) {
+    send({'kind': 'nomination_vote', 'vote': vote});
+    document.getElementById('voteStatus').innerText = `You have voted to ${vote ? "approve" : "reject"} the mission.`;
+}
+
+function mission_vote(vote) {
+    send({'kind': 'mission_vote', 'vote': vote});
+    document.getElementById('missionStatus').innerText = `You want the mission to ${vote ? "pass" : "fail"}.`;
+}
+
+function send(message) {
+    socket.send(JSON.stringify(message));
+}
+
+// undo protocol.compact: full names for keys, kinds and players
+function expand(message) {
+    const start = message.gs || message;
+    if (start.k === GAME_START) {
+        seating = start.p;
+    }
+    const output = {};
+    for (let [key, value] of Object.entries(message)) {
+        key = LONG_KEYS[key] || key;
+        if (key === "kind") {
+            value = COMPACT.kinds[value];
+        } else if (COMPACT.seat.includes(key)) {
+            value = seating[value];
+        } else if (COMPACT.seat_lists.includes(key)) {
+            value = value.map(seat => seating[seat]);
+        } else if (COMPACT.seat_maps.includes(key)) {
+            value = Object.fromEntries(value.map((vote, seat) => [seating[seat], vote]));
+        } else if (COMPACT.messages.includes(key)) {
+            value = expand(value);
+        } else if (COMPACT.message_lists.includes(key)) {
+            value = value.map(expand);
+        }
+        output[key] = value;
+    }
+    return output;
+}
+
+function list(words) {
+    if (words.length === 0) {
+        return "";
+    } else if (words.length === 1) {
+        return words[0]
+    } else if (words.length === 2) {
+        return `${words[0]} and ${words[1]}`;
+    }
+    let output = "";
+    for (let i = 0; i + 1 < words.length; i++) {
+        output += words[i] + ", ";
+    }
+    output += "and " + words[words.length - 1];
+    return output;
+}
+
+function mission_id(mission_num) {
+    return `mission${mission_num}`;
+}
+
+function votetrack_id(vote_track) {
+    return `votetrack${vote_track}`;
+}
+
+function missionsize_id(mission_num) {
+    return `missionsize${mission_num}`;
+}
+
+function nameplate_id(player) {
+    return `${player}-namePlate`;
+}
+
+function results_id(round) {
+    return `results${round}`;
+}
+
+socket.onmessage = function (event) {
+    let update = JSON.parse(event.data);
+    if (socket.protocol === "resistance.compact") {
+        update = expand(update);
+    }
+    if (update.kind === "snapshot") {
+        lastSeq = update.seq;
+    } else if (update.seq !== undefined) {
+        if (lastSeq >= 0 && update.seq !== lastSeq + 1) {
+            send({'kind': 'catch_up'});  // we missed something
+        }
+        lastSeq = update.seq;
+    }
+    const handler = HANDLERS[update.kind];
+    if (handler !== undefined) {
+        handler(update);
+    }
+};
+
+socket.onclose = function (event) {
+    window.setTimeout(() => location.reload(), 1000);
+};
+
+socket.onopen = () => send({'kind': 'catch_up'});
+
+// https://stackoverflow.com/a/506193/8033766
+function loadBG() {
+    document.body.style.backgroundImage = `url(${URLS.background})`;
+    document.body.style.backgroundSize = "cover";
+}
+
+window.onload = loadBG;
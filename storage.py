@@ -1,46 +1,373 @@
+import asyncio
+import logging
+import os
 import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from os.path import dirname, join
+from functools import partial
+from hashlib import sha256
+from json import dumps, loads
+from os.path import dirname, isfile, join
 from secrets import token_hex
+from time import perf_counter
 
-from crypt import gen_salt, hash_password
+import metrics
+import thumbnails
+
+logger = logging.getLogger(__name__)
+
+
+class AvatarStore:
+    """
+    Content-addressed files on disk, named by the SHA-256 of their contents.
+
+    Renditions are named after the file they were made from, their size and
+    the extension of their real type, so a name can't claim another type.
+    """
+
+    EXTENSIONS = {
+        "image/jpeg": "jpg",
+        "image/png": "png",
+        "image/gif": "gif",
+        "image/webp": "webp",
+    }
+    MIMETYPES = {extension: mimetype for mimetype, extension in EXTENSIONS.items()}
+
+    def __init__(self, root):
+        self.root = root
+
+    def save(self, data, name=None):
+        """
+        Store some bytes (if not already stored) and return their hash.
+
+        Files derived from a stored file can pass `name` to be stored under
+        `rendition_name(digest, size)` instead of their own hash.
+        """
+        digest = sha256(data).hexdigest()
+        path = join(self.root, name or digest)
+        if not isfile(path):
+            os.makedirs(self.root, exist_ok=True)
+            temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+            with open(temp_path, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        return digest
+
+    @classmethod
+    def rendition_name(cls, digest, size, mimetype=thumbnails.MIMETYPE):
+        return "{}-{}.{}".format(digest, size, cls.EXTENSIONS[mimetype])
+
+    @classmethod
+    def mimetype(cls, name):
+        """Return the type a name's extension stands for, or None."""
+        _, _, extension = name.partition(".")
+        return cls.MIMETYPES.get(extension)
+
+    def path(self, name):
+        """Return the path of a stored file, or None if there is no such file."""
+        stem, dot, extension = name.partition(".")
+        if dot and extension not in self.MIMETYPES:
+            return None
+        digest, _, size = stem.partition("-")
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None
+        if size and not size.isdigit():
+            return None
+        path = join(self.root, name)
+        return path if isfile(path) else None
+
+
+AVATARS = AvatarStore(
+    os.environ.get("RESISTANCE_AVATARS", join(dirname(__file__), "avatars"))
+)
+
+
+def _move_profile_pics(cursor):
+    """Move profile picture BLOBs out of the users table into `AVATARS`."""
+    rows = cursor.execute(
+        "SELECT username_lower, profile_pic FROM users WHERE profile_pic IS NOT NULL"
+    ).fetchall()
+    for username, picture in rows:
+        cursor.execute(
+            "UPDATE users SET pic_hash=?, profile_pic=NULL WHERE username_lower=?",
+            (AVATARS.save(picture), username),
+        )
+
+
+def _add_renditions(cursor):
+    """Make `thumbnails` renditions of profile pictures stored without them."""
+    rows = cursor.execute(
+        "SELECT DISTINCT pic_hash FROM users WHERE pic_hash IS NOT NULL"
+    ).fetchall()
+    for (digest,) in rows:
+        path = AVATARS.path(digest)
+        names = [AVATARS.rendition_name(digest, size) for size in thumbnails.SIZES]
+        if path is None or all(AVATARS.path(name) for name in names):
+            continue
+        with open(path, "rb") as picture:
+            data = picture.read()
+        try:
+            renditions = thumbnails.make_renditions(data)
+        except thumbnails.InvalidImage:
+            logger.warning("Couldn't make renditions of avatar %s.", digest)
+            continue
+        for size, rendition in renditions.items():
+            AVATARS.save(rendition, AVATARS.rendition_name(digest, size))
+
+
+def _name_renditions(cursor):
+    """Add their type's extension to the names of existing renditions."""
+    rows = cursor.execute(
+        "SELECT DISTINCT pic_hash FROM users WHERE pic_hash IS NOT NULL"
+    ).fetchall()
+    for (digest,) in rows:
+        for size in thumbnails.SIZES:
+            old = join(AVATARS.root, "{}-{}".format(digest, size))
+            if isfile(old):
+                os.replace(
+                    old, join(AVATARS.root, AVATARS.rendition_name(digest, size))
+                )
+
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # readers don't block behind writers
+    "PRAGMA synchronous=NORMAL",  # safe with WAL, avoids an fsync per commit
+    "PRAGMA cache_size=-16000",  # 16 MB page cache per connection
+    "PRAGMA mmap_size=67108864",  # 64 MB
+    "PRAGMA busy_timeout=5000",
+)
+
+# Each migration is a sequence of SQL statements (or functions taking a cursor),
+# applied in order exactly once.
+MIGRATIONS = (
+    (
+        "CREATE TABLE IF NOT EXISTS cookies "
+        "(cookie TEXT PRIMARY KEY, user TEXT, expiration DATETIME NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS users "
+        "(username_lower TEXT PRIMARY KEY, username TEXT, passwd_hash TEXT NOT NULL, salt TEXT NOT NULL, "
+        "profile_pic BLOB, pic_mimetype TEXT)",
+    ),
+    (
+        "CREATE INDEX IF NOT EXISTS cookies_expiration ON cookies (expiration)",
+        "CREATE INDEX IF NOT EXISTS cookies_user ON cookies (user)",
+    ),
+    (
+        "ALTER TABLE users ADD COLUMN pic_hash TEXT",
+        _move_profile_pics,
+    ),
+    (
+        "CREATE TABLE IF NOT EXISTS game_events "
+        "(run TEXT NOT NULL, game_id INTEGER NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS game_events_run ON game_events (run)",
+    ),
+    (
+        "CREATE TABLE IF NOT EXISTS live_games "
+        "(game_id INTEGER PRIMARY KEY, worker TEXT)",
+    ),
+    (
+        "CREATE TABLE IF NOT EXISTS games "
+        "(id INTEGER PRIMARY KEY, run TEXT UNIQUE NOT NULL, game_id INTEGER NOT NULL, "
+        "finished INTEGER NOT NULL, resistance_won INTEGER NOT NULL, mission_results TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS game_players "
+        "(game INTEGER NOT NULL REFERENCES games (id), username TEXT NOT NULL, "
+        "seat INTEGER NOT NULL, is_spy INTEGER NOT NULL, PRIMARY KEY (game, username))",
+        "CREATE INDEX IF NOT EXISTS game_players_username ON game_players (username, game)",
+        "CREATE TABLE IF NOT EXISTS user_stats "
+        "(username TEXT PRIMARY KEY, games INTEGER NOT NULL, wins INTEGER NOT NULL, "
+        "spy_games INTEGER NOT NULL, spy_wins INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS user_stats_wins ON user_stats (wins)",
+    ),
+    (_add_renditions,),
+    (
+        "CREATE TABLE IF NOT EXISTS game_runs "
+        "(run TEXT PRIMARY KEY, game_id INTEGER NOT NULL, finished INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO game_runs "
+        "SELECT run, game_id, MAX(kind IN ('end', 'abort')) FROM game_events "
+        "GROUP BY run ORDER BY MIN(rowid)",
+        "CREATE INDEX IF NOT EXISTS game_runs_unfinished ON game_runs (game_id) "
+        "WHERE finished = 0",
+    ),
+    (_name_renditions,),
+)
+
+
+class ConnectionPool:
+    """Hand out long-lived SQLite connections, one per thread.
+
+    Connections are opened lazily (running `pragmas` on each), reused for
+    every cursor on the same thread, checked with a trivial query only after
+    a statement fails, and closed by `close_all`. SQLite only lets a connection be closed by the thread that
+    opened it. A thread that would open more than `max_connections` waits up
+    to `TIMEOUT` seconds for another thread to close one.
+    """
+
+    TIMEOUT = 5.0
+
+    def __init__(self, path, max_connections=8, pragmas=PRAGMAS):
+        self.path = path
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._available = threading.BoundedSemaphore(max_connections)
+
+    def _open(self):
+        if not self._available.acquire(timeout=self.TIMEOUT):
+            raise RuntimeError("Too many SQLite connections are open.")
+        try:
+            conn = sqlite3.connect(self.path)
+            for pragma in self.pragmas:
+                conn.execute(pragma)
+        except BaseException:
+            self._available.release()
+            raise
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn not in self._connections:
+                return
+            self._connections.remove(conn)
+        self._available.release()
+        conn.close()
+
+    @staticmethod
+    def _healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def connection(self):
+        """Return this thread's connection, opening it if needed."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    def recover(self, conn):
+        """After a statement failed, roll back, and drop `conn` if it's broken."""
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass
+        if self._healthy(conn):
+            return
+        if getattr(self._local, "conn", None) is conn:
+            self._local.conn = None
+        try:
+            self._discard(conn)
+        except sqlite3.Error:
+            logger.warning("Couldn't close a broken connection.", exc_info=True)
+
+    def close(self):
+        """Close this thread's connection, if it has one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            self._discard(conn)
+
+    async def close_all(self, executor, threads):
+        """
+        Close every connection, each on the thread that opened it.
+
+        One task runs on each of `executor`'s `threads` worker threads, after
+        any work already queued; the calling thread closes its own. Anything
+        still open after that was opened by some other thread, and is logged.
+        """
+        barrier = threading.Barrier(threads, timeout=30)
+
+        def close():
+            barrier.wait()  # hold this thread, so that every thread gets one
+            self.close()
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(executor, close) for _ in range(threads))
+        )
+        self.close()
+        if self._connections:
+            logger.warning(
+                "%d connections opened on other threads were left open.",
+                len(self._connections),
+            )
+
+
+EXECUTOR_THREADS = 4
+# a connection for each executor thread, plus one for the event loop's thread
+POOL = ConnectionPool(
+    os.environ.get(
+        "RESISTANCE_DATABASE", join(dirname(__file__), "resistance.sqlite3")
+    ),
+    EXECUTOR_THREADS + 1,
+)
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=EXECUTOR_THREADS, thread_name_prefix="storage"
+)
 
 
 class CursorManager:
     """Class to manage acquiring a cursor and committing afterward."""
 
-    @staticmethod
-    def _connection():
-        return sqlite3.connect(join(dirname(__file__), "resistance.sqlite3"))
+    def __init__(self, pool=POOL):
+        self.pool = pool
 
     def __enter__(self):
         """Obtain a connection and cursor."""
-        self._conn = self._connection()
+        self._started = perf_counter()
+        self._conn = self.pool.connection()
         return self._conn.cursor()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Commit the connection."""
-        self._conn.commit()
+        """Commit the connection, or roll back if the block raised."""
+        if exc_type is None:
+            self._conn.commit()
+        elif issubclass(exc_type, sqlite3.Error):
+            self.pool.recover(self._conn)
+        else:
+            self._conn.rollback()
+        metrics.STORAGE_SECONDS.observe(perf_counter() - self._started)
         return False
 
 
+def migrate(pool=POOL):
+    """Bring the database schema up to date with `MIGRATIONS`."""
+    with CursorManager(pool) as cursor:
+        cursor.execute("BEGIN IMMEDIATE")  # one migrator at a time
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"
+        )
+        row = cursor.execute("SELECT version FROM schema_version").fetchone()
+        current = 0 if row is None else row[0]
+        for migration in MIGRATIONS[current:]:
+            for statement in migration:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+        if row is None:
+            cursor.execute("INSERT INTO schema_version VALUES (?)", (len(MIGRATIONS),))
+        elif current < len(MIGRATIONS):
+            cursor.execute("UPDATE schema_version SET version=?", (len(MIGRATIONS),))
+
+
 class Storage:
     TABLE_NAME = None
-    TABLE_SCHEMA = ""
 
     @property
     def cursor(self):
-        return CursorManager()
+        return CursorManager(self.pool)
 
-    def __init__(self):
+    def __init__(self, pool=POOL):
         if self.TABLE_NAME is None:
             raise NotImplementedError("`TABLE_NAME` needs to be specified.")
-        with self.cursor as cursor:
-            cursor.execute(
-                "CREATE TABLE IF NOT EXISTS {} ({})".format(
-                    self.TABLE_NAME, self.TABLE_SCHEMA
-                )
-            )
+        self.pool = pool
+        migrate(pool)
 
     def __len__(self):
         with self.cursor as cursor:
@@ -96,17 +423,11 @@ class Storage:
 
     def clear(self):
         with self.cursor as cursor:
-            cursor.execute("DROP TABLE {}".format(self.TABLE_NAME))
-            cursor.execute(
-                "CREATE TABLE IF NOT EXISTS {} ({})".format(
-                    self.TABLE_NAME, self.TABLE_SCHEMA
-                )
-            )
+            cursor.execute("DELETE FROM {}".format(self.TABLE_NAME))
 
 
 class Cookies(Storage):
     TABLE_NAME = "cookies"
-    TABLE_SCHEMA = "cookie TEXT PRIMARY KEY, user TEXT, expiration DATETIME NOT NULL"
     VALID_LENGTH = timedelta(days=7)
 
     def check(self, cookie):
@@ -134,17 +455,27 @@ class Cookies(Storage):
         return val
 
     def prune(self):
-        """Remove cookies that are out-of-date."""
+        """Remove cookies that are out-of-date, returning how many were removed."""
         now = int(datetime.now().timestamp())
         with self.cursor as cursor:
-            cursor.execute(
+            return cursor.execute(
                 "DELETE FROM {} WHERE expiration < ?".format(self.TABLE_NAME), (now,)
-            )
+            ).rowcount
 
     def remove(self, cookie):
         """Remove a cookie as part of a logout."""
         self._remove("cookie", cookie)
 
+    def session(self, cookie):
+        """Return the user and expiration timestamp of a valid cookie, or None."""
+        with self.cursor as cursor:
+            return cursor.execute(
+                "SELECT user, expiration FROM {} WHERE cookie=? AND expiration>?".format(
+                    self.TABLE_NAME
+                ),
+                (cookie, int(datetime.now().timestamp())),
+            ).fetchone()
+
     def user(self, cookie):
         """Get the username associated with the auth cookie."""
         if cookie is None:
@@ -152,14 +483,63 @@ class Cookies(Storage):
         return self._get_row("cookie", cookie, "user")[0]
 
 
+class SessionCache:
+    """Bounded LRU cache of valid auth cookies in front of `Cookies`.
+
+    Entries remember the cookie's expiration, so an expired cookie is rejected
+    without a database round-trip. `invalidate` must be called when a cookie is
+    removed (e.g. on log out). If other processes can remove cookies too, set
+    `max_age` to bound how long they may go unnoticed.
+    """
+
+    def __init__(self, cookies, max_size=4096, max_age=None):
+        self.cookies = cookies  # an AsyncStorage-wrapped `Cookies`
+        self.max_size = max_size
+        self.max_age = max_age
+        self._hits = metrics.CACHE_LOOKUPS.labels("sessions", "hit")
+        self._misses = metrics.CACHE_LOOKUPS.labels("sessions", "miss")
+        self._sessions = OrderedDict()
+        self._generation = 0
+
+    async def user(self, cookie):
+        """Get the username for a valid auth cookie, or None."""
+        if cookie is None:
+            return None
+        entry = self._sessions.get(cookie)
+        if entry is not None:
+            user, expiration = entry
+            if expiration > datetime.now().timestamp():
+                self._hits.inc()
+                self._sessions.move_to_end(cookie)
+                return user
+            del self._sessions[cookie]
+
+        self._misses.inc()
+        generation = self._generation
+        session = await self.cookies.session(cookie)
+        if session is None:
+            return None
+        if generation == self._generation:  # not invalidated while we waited
+            if self.max_age is not None:
+                user, expiration = session
+                session = user, min(
+                    expiration, datetime.now().timestamp() + self.max_age
+                )
+            self._sessions[cookie] = session
+            if len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+        return session[0]
+
+    def invalidate(self, cookie):
+        """Forget a cookie so the next lookup goes back to the database."""
+        self._generation += 1
+        self._sessions.pop(cookie, None)
+
+
 class Users(Storage):
     TABLE_NAME = "users"
-    TABLE_SCHEMA = (
-        "username_lower TEXT PRIMARY KEY, username TEXT, passwd_hash TEXT NOT NULL, salt TEXT NOT NULL, "
-        "profile_pic BLOB, pic_mimetype TEXT"
-    )
 
-    def register(self, username, password):
+    def register(self, username, passwd_hash, salt):
         """Check if a user can be registered, and if so, register them."""
         with self.cursor as cursor:
             if (
@@ -170,60 +550,244 @@ class Users(Storage):
                 is not None
             ):
                 return "That username is taken."
-            salt = gen_salt()
-            passwd_hash = hash_password(password, salt)
             cursor.execute(
                 f"INSERT INTO {self.TABLE_NAME} (username_lower, username, passwd_hash, salt) VALUES (?, ?, ?, ?)",
                 (username.lower(), username, passwd_hash, salt),
             )
 
-    def authenticate(self, username, password):
-        """Check a user's credentials, returning their true username if valid."""
-        with self.cursor as cursor:
-            user_row = cursor.execute(
-                "SELECT username, passwd_hash, salt FROM {} WHERE username_lower=?".format(
-                    self.TABLE_NAME
-                ),
-                (username.lower(),),
-            ).fetchone()
-            if user_row is None:
-                return
-            true_username, passwd_hash, salt = user_row
-            if passwd_hash == hash_password(password, salt):
-                return true_username
+    def credentials(self, username):
+        """Return a user's true username, password hash and salt, if they exist."""
+        return self._get_row(
+            "username_lower", username.lower(), "username", "passwd_hash", "salt"
+        )
 
-    def change_password(self, username, new_password):
-        """Change a user's password."""
-        username = username.lower()
+    def change_password(self, username, new_hash):
+        """Replace a user's password hash. The salt is left unchanged."""
         with self.cursor as cursor:
-            salt = cursor.execute(
-                f"SELECT salt FROM {self.TABLE_NAME} WHERE username_lower=?",
-                (username,),
-            ).fetchone()[0]
-            print(salt)
-            new_hash = hash_password(new_password, salt)
             cursor.execute(
                 f"UPDATE {self.TABLE_NAME} SET passwd_hash=? WHERE username_lower=?",
                 (new_hash, username.lower()),
-            ).fetchone()
+            )
 
     def profile_pic(self, username):
-        """Return a user's profile picture."""
+        """Return the `AVATARS` hash and mimetype of a user's profile picture."""
         username = username.lower()
         with self.cursor as cursor:
             row = cursor.execute(
-                f"SELECT profile_pic, pic_mimetype FROM {self.TABLE_NAME} WHERE username_lower=?",
+                f"SELECT pic_hash, pic_mimetype FROM {self.TABLE_NAME} WHERE username_lower=?",
                 (username,),
             ).fetchone()
             if row is None:
                 return None, None
             return row
 
-    def set_profile(self, username, picture, mimetype):
-        """Set a user's profile picture."""
+    def set_profile(self, username, picture, mimetype, renditions=None):
+        """Set a user's profile picture, with optional resized copies by size."""
         username = username.lower()
+        digest = AVATARS.save(picture)
+        for size, rendition in (renditions or dict()).items():
+            AVATARS.save(rendition, AVATARS.rendition_name(digest, size))
+        with self.cursor as cursor:
+            cursor.execute(
+                f"UPDATE {self.TABLE_NAME} SET pic_hash=?, pic_mimetype=? WHERE username_lower=?",
+                (digest, mimetype, username),
+            )
+
+
+class GameEvents(Storage):
+    """
+    Every game run's events, in order.
+
+    `game_runs` keeps a row per run, marked finished by its final event, so
+    finding the runs to restore on startup doesn't scan every event.
+    """
+
+    TABLE_NAME = "game_events"
+    FINAL_KINDS = ("end", "abort")
+
+    def append(self, events):
+        """Store (run, game_id, kind, JSON data) events in a single transaction."""
+        runs = dict.fromkeys((run, game_id) for run, game_id, _, _ in events)
+        finished = [(run,) for run, _, kind, _ in events if kind in self.FINAL_KINDS]
+        with self.cursor as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.TABLE_NAME} VALUES (?, ?, ?, ?)",
+                events,
+            )
+            cursor.executemany(
+                "INSERT OR IGNORE INTO game_runs (run, game_id) VALUES (?, ?)", runs
+            )
+            cursor.executemany(
+                "UPDATE game_runs SET finished = 1 WHERE run=?", finished
+            )
+
+    def events(self, run):
+        """Return the (kind, data) events of one game run, in order."""
+        with self.cursor as cursor:
+            return [
+                (kind, loads(data))
+                for kind, data in cursor.execute(
+                    f"SELECT kind, data FROM {self.TABLE_NAME} WHERE run=? ORDER BY rowid",
+                    (run,),
+                )
+            ]
+
+    def unfinished(self):
+        """Return (run, game_id) of every game run that never ended, oldest first."""
+        with self.cursor as cursor:
+            # `+rowid`: sorting by rowid would otherwise scan every run in order,
+            # instead of the partial index of unfinished ones
+            return cursor.execute(
+                "SELECT run, game_id FROM game_runs WHERE finished = 0 ORDER BY +rowid"
+            ).fetchall()
+
+
+class EventLog:
+    """
+    Buffer game events in memory and write them to `GameEvents` in batches.
+
+    `record` is cheap enough to call on every transition; `flush` should be
+    called periodically (and on shutdown) to group-commit whatever is pending.
+    """
+
+    def __init__(self, events):
+        self.events = events  # an AsyncStorage-wrapped `GameEvents`
+        self._pending = []
+
+    def record(self, run, game_id, kind, data):
+        # encode now: `data` may refer to state the game goes on to change
+        self._pending.append((run, game_id, kind, dumps(data)))
+
+    async def flush(self):
+        """Write every pending event in one transaction."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await self.events.append(batch)
+        except Exception:
+            self._pending[:0] = batch  # try again next time
+            raise
+
+
+class UserStats(namedtuple("UserStats", "username games wins spy_games spy_wins")):
+    """A player's totals over every finished game they played."""
+
+    @property
+    def resistance_games(self):
+        return self.games - self.spy_games
+
+    @property
+    def resistance_wins(self):
+        return self.wins - self.spy_wins
+
+
+class GameHistory(Storage):
+    """
+    Finished games, who played them, and each player's running totals.
+
+    `user_stats` is updated in the same transaction that records a game, so
+    reading a player's statistics or the leaderboard never scans history.
+    """
+
+    TABLE_NAME = "games"
+
+    def record(self, run, game_id, players, spies, mission_results, resistance_won):
+        """Store a finished game and add it to its players' statistics."""
+        finished = int(datetime.now().timestamp())
         with self.cursor as cursor:
             cursor.execute(
-                f"UPDATE {self.TABLE_NAME} SET profile_pic=?, pic_mimetype=? WHERE username_lower=?",
-                (picture, mimetype, username),
+                f"INSERT INTO {self.TABLE_NAME} "
+                "(run, game_id, finished, resistance_won, mission_results) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run, game_id, finished, resistance_won, dumps(mission_results)),
             )
+            game = cursor.lastrowid
+            seats = [
+                (game, player, seat, player in spies)
+                for seat, player in enumerate(players)
+            ]
+            cursor.executemany("INSERT INTO game_players VALUES (?, ?, ?, ?)", seats)
+            cursor.executemany(
+                "INSERT INTO user_stats VALUES (?, 1, ?, ?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET "
+                "games = games + 1, wins = wins + excluded.wins, "
+                "spy_games = spy_games + excluded.spy_games, "
+                "spy_wins = spy_wins + excluded.spy_wins",
+                [
+                    (
+                        player,
+                        is_spy != resistance_won,
+                        is_spy,
+                        is_spy and not resistance_won,
+                    )
+                    for _, player, _, is_spy in seats
+                ],
+            )
+
+    def stats(self, username):
+        """Return a player's `UserStats`, or None if they haven't finished a game."""
+        with self.cursor as cursor:
+            row = cursor.execute(
+                "SELECT * FROM user_stats WHERE username=?", (username,)
+            ).fetchone()
+        return None if row is None else UserStats(*row)
+
+    def leaderboard(self, limit=20):
+        """Return the `UserStats` of the players with the most wins."""
+        with self.cursor as cursor:
+            return [
+                UserStats(*row)
+                for row in cursor.execute(
+                    "SELECT * FROM user_stats ORDER BY wins DESC, games ASC LIMIT ?",
+                    (limit,),
+                )
+            ]
+
+
+class LiveGames(Storage):
+    """Registry of started games, shared by every worker process."""
+
+    TABLE_NAME = "live_games"
+
+    def add(self, game_id, worker):
+        with self.cursor as cursor:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {self.TABLE_NAME} VALUES (?, ?)",
+                (game_id, worker),
+            )
+
+    def remove(self, game_id):
+        self._remove("game_id", game_id)
+
+    def remove_worker(self, worker):
+        """Forget every game a worker registered, e.g. before it restores them."""
+        self._remove("worker", worker)
+
+    def game_ids(self):
+        return list(self._iterate_column("game_id"))
+
+
+class AsyncStorage:
+    """Expose a Storage's methods as coroutines that run on a worker thread.
+
+    Attributes that are not callable (e.g. `Cookies.VALID_LENGTH`) are returned
+    as-is, so an `AsyncStorage` can stand in for the object it wraps.
+    """
+
+    def __init__(self, storage, executor=EXECUTOR):
+        self._storage = storage
+        self._executor = executor
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if not callable(attr):
+            return attr
+
+        async def run_in_executor(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, partial(attr, *args, **kwargs)
+            )
+
+        return run_in_executor
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import tracemalloc
+from random import Random
+
+import pytest
+
+from connections import (
+    DISCONNECT,
+    RESYNC,
+    ConnectionRegistry,
+    GameConnections,
+    SendQueue,
+    TokenBucket,
+    UserBuckets,
+)
+from engine import GameStates
+from game import Game
+
+
+def test_offer_keeps_frames_in_order_within_maxsize():
+    queue = SendQueue(4)
+    for frame in ("a", "b", "c", "d"):
+        queue.offer(frame)
+    assert [queue.get_nowait() for _ in range(4)] == ["a", "b", "c", "d"]
+    assert queue.dropped == queue.overflows == 0
+
+
+def test_disconnect_policy_drops_everything_and_closes():
+    queue = SendQueue(4, DISCONNECT)
+    for i in range(10):
+        queue.offer(str(i))
+    assert queue.qsize() == 1
+    assert queue.dropped == 10
+    assert queue.overflows == 1
+    assert asyncio.run(queue.get()) is SendQueue.CLOSE
+
+
+def test_resync_policy_catches_up_then_queues_again():
+    queue = SendQueue(4, RESYNC)
+    for i in range(10):
+        queue.offer(str(i))
+    assert queue.qsize() == 1
+    assert asyncio.run(queue.get()) is SendQueue.CATCH_UP
+    queue.offer("after")
+    assert queue.get_nowait() == "after"
+
+
+def test_close_drops_pending_frames():
+    queue = SendQueue(4)
+    queue.offer("a")
+    queue.offer("b")
+    queue.close()
+    assert queue.dropped == 2
+    assert asyncio.run(queue.get()) is SendQueue.CLOSE
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        SendQueue(4, "wait")
+
+
+def broadcast_to_stalled_clients(maxsize, clients=50, broadcasts=2000):
+    """
+    Broadcast to `clients` queues nobody reads, plus one that is read, and
+    return the stalled queues, the frames read and the memory they grew by.
+    """
+
+    async def run():
+        connections = GameConnections()
+        stalled = [SendQueue(maxsize, RESYNC) for _ in range(clients)]
+        for i, queue in enumerate(stalled):
+            connections.add(queue, f"stalled{i}")
+        reader = SendQueue(maxsize, RESYNC)
+        connections.add(reader, "reader")
+        game = Game(connections)
+        await game.broadcast({"kind": "lobby_update", "players": []})  # warm up
+        reader.get_nowait()
+
+        read = 0
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for _ in range(broadcasts):
+                await game.broadcast({"kind": "lobby_update", "players": ["x"] * 10})
+                while not reader.empty():
+                    reader.get_nowait()
+                    read += 1
+            grown = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        return stalled, read, grown
+
+    return asyncio.run(run())
+
+
+def test_stalled_clients_use_bounded_memory():
+    stalled, read, grown = broadcast_to_stalled_clients(16)
+    assert read == 2000  # a stalled client doesn't hold up the others
+    assert all(queue.qsize() == 1 for queue in stalled)
+    assert all(queue.get_nowait() is SendQueue.CATCH_UP for queue in stalled)
+    assert grown < 100_000
+
+
+def test_unbounded_queues_grow_with_stalled_clients():
+    # checks that the test above would notice queues growing without bound
+    _, _, grown = broadcast_to_stalled_clients(0)
+    assert grown > 500_000
+
+
+def test_registry_counts_connections_until_they_disconnect():
+    registry = ConnectionRegistry()
+    registry.hold(1)
+    queues = [SendQueue(4) for _ in range(5)]
+    for i, queue in enumerate(queues):
+        registry.connect(1, queue, f"user{i}")
+    registry.release(1)  # the game ended; its sockets are still open
+    assert len(registry) == 5
+    assert len(registry.hold(1)) == 0  # a new game with the same ID
+    assert registry.disconnect(1, queues[0]) is False  # not the new game's
+    assert len(registry) == 4
+    for queue in queues[1:]:
+        registry.disconnect(1, queue)
+    assert len(registry) == 0
+    assert 1 in registry.games
+
+
+def test_token_bucket_has_without_taking():
+    bucket = TokenBucket(rate=0, burst=2)
+    assert bucket.has(2)
+    assert bucket.take(2)
+    assert not bucket.has(1)
+    assert not bucket.take(1)
+
+
+def test_user_buckets_are_shared_per_user_only():
+    buckets = UserBuckets(rate=0, burst=1)
+    first, second = object(), object()  # e.g. two anonymous connections' queues
+    assert buckets.open("alice") is buckets.open("alice")
+    assert buckets.open(first) is not buckets.open(second)
+    buckets.close("alice")
+    assert "alice" in buckets.buckets
+    buckets.close("alice")
+    assert "alice" not in buckets.buckets
+
+
+async def play_to_the_end(game, players, seed=0):
+    """Play random moves until `game` is over."""
+    choices = Random(seed)
+    engine = game.engine
+    while game.state != GameStates.GAME_OVER:
+        if game.state == GameStates.NOMINATING:
+            leader = engine.players[engine.mission_leader]
+            nomination = choices.sample(players, engine.mission_size())
+            move = {"kind": "nominate", "nomination": nomination}
+            await game.player_move(leader, move, None)
+        elif game.state == GameStates.VOTING_MISSION:
+            for player in players:
+                move = {"kind": "nomination_vote", "vote": choices.random() < 0.6}
+                await game.player_move(player, move, None)
+        else:
+            for player in tuple(engine.mission):
+                move = {"kind": "mission_vote", "vote": player not in engine.spies}
+                await game.player_move(player, move, None)
+
+
+def test_catch_up_after_the_game_ends_sends_how_it_ended():
+    async def run():
+        connections = GameConnections()
+        players = [f"player{i}" for i in range(5)]
+        stalled = SendQueue(4, RESYNC)
+        connections.add(stalled, players[0])
+        game = Game(connections)
+        for player in players:
+            await game.join(player)
+        await game.begin(players, 1)
+        await play_to_the_end(game, players)
+        # it overflowed near the end, so it missed `game_over`
+        assert await stalled.get() is SendQueue.CATCH_UP
+        await game.catch_up(players[0], stalled)
+        return game, json.loads(stalled.get_nowait())
+
+    game, snapshot = asyncio.run(run())
+    assert snapshot["kind"] == "snapshot"
+    assert snapshot["state"] == "GAME_OVER"
+    assert snapshot["last_state_change"] == {
+        "kind": "game_over",
+        "resistance_won": game.engine.resistance_won(),
+        "spies": list(game.spies),
+    }
+
+
+def test_catch_up_after_an_abort_sends_the_final_state():
+    async def run():
+        queue = SendQueue(4, RESYNC)
+        connections = GameConnections()
+        connections.add(queue, "waiting")
+        game = Game(connections)
+        await game.join("waiting")
+        while not queue.empty():
+            queue.get_nowait()
+        game.abort()
+        await game.catch_up("waiting", queue)
+        return json.loads(queue.get_nowait())
+
+    snapshot = asyncio.run(run())
+    assert snapshot["state"] == "ABORTED"
+    assert snapshot["lobby"] == ["waiting"]
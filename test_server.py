@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+from io import BytesIO
+from time import perf_counter, sleep
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import storage
+import thumbnails
+from sharding import ShardMap, worker_urls
+
+
+@pytest.fixture(scope="module")
+def server():
+    # conftest.py points its database and avatars at a temporary directory
+    import server
+
+    return server
+
+
+async def logged_in(app, username):
+    client = app.test_client()
+    form = {"username": username, "password": "password"}
+    await client.post("/sign_up", form=form)
+    await client.post("/log_in", form=form)
+    return client
+
+
+async def round_trips(ws, count, interval=0.02):
+    """Return the seconds from each `start` move to the broadcast it causes."""
+    latencies = []
+    for _ in range(count):
+        started = perf_counter()
+        await ws.send(json.dumps({"kind": "start"}))
+        while json.loads(await ws.receive())["kind"] != "ready_update":
+            pass
+        latencies.append(perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def picture(size=1_900_000):
+    """Return a PNG of noise just under the upload limit."""
+    edge = int((size / 3) ** 0.5)
+    image = Image.frombytes("RGB", (edge, edge), os.urandom(edge * edge * 3))
+    output = BytesIO()
+    image.save(output, format="PNG", compress_level=0)
+    return output.getvalue()
+
+
+def test_serving_twice(server):
+    async def serve():
+        async with server.app.test_app() as app:
+            response = await app.test_client().get("/")
+            assert response.status_code == 200
+
+    asyncio.run(serve())
+    asyncio.run(serve())
+
+
+def photo():
+    """Return a small JPEG whose EXIF data names where it was taken."""
+    exif = Image.Exif()
+    exif[0x010E] = "taken at 51.5N 0.1W"  # ImageDescription
+    output = BytesIO()
+    Image.new("RGB", (400, 300), "red").save(output, format="JPEG", exif=exif)
+    return output.getvalue()
+
+
+def test_profile_pictures_are_served_without_metadata(server):
+    async def run():
+        async with server.app.test_app() as app:
+            client = await logged_in(app, "exif_uploader")
+            await client.post(
+                "/profile/me/",
+                files={
+                    "profile-picture": FileStorage(
+                        BytesIO(photo()), filename="me.jpg", content_type="image/jpeg"
+                    )
+                },
+            )
+            redirect = await client.get("/profilepic/exif_uploader")
+            served = await client.get(redirect.location)
+            data = await served.get_data()
+            digest, _ = await server.USERS.profile_pic("exif_uploader")
+            original = await client.get(f"/avatar/{digest}.jpg")
+            mislabelled = await client.get(redirect.location.replace(".webp", ".gif"))
+            return redirect.location, served, data, original, mislabelled
+
+    location, served, data, original, mislabelled = asyncio.run(run())
+    assert location.endswith("-200.webp")  # the largest rendition by default
+    assert served.status_code == 200
+    assert served.mimetype == "image/webp"
+    assert b"51.5N" not in data
+    assert not Image.open(BytesIO(data)).getexif()
+    assert original.status_code == 404
+    assert mislabelled.status_code == 404
+
+
+def test_migrated_profile_pictures_get_renditions(server):
+    digest = storage.AVATARS.save(photo())
+    with storage.CursorManager() as cursor:
+        cursor.execute(
+            "INSERT INTO users (username_lower, username, passwd_hash, salt, pic_hash) "
+            "VALUES ('migrated', 'migrated', '', '', ?)",
+            (digest,),
+        )
+        storage._add_renditions(cursor)
+    for size in thumbnails.SIZES:
+        assert storage.AVATARS.path(storage.AVATARS.rendition_name(digest, size))
+
+
+def test_renditions_get_their_types_extension(server):
+    data = photo()
+    digest = storage.AVATARS.save(data)
+    storage.AVATARS.save(data, f"{digest}-100")  # named as renditions used to be
+    with storage.CursorManager() as cursor:
+        cursor.execute(
+            "INSERT INTO users (username_lower, username, passwd_hash, salt, pic_hash) "
+            "VALUES ('unnamed', 'unnamed', '', '', ?)",
+            (digest,),
+        )
+        storage._name_renditions(cursor)
+    assert storage.AVATARS.path(f"{digest}-100") is None
+    assert storage.AVATARS.path(f"{digest}-100.webp")
+
+
+def test_play_redirects_to_the_owners_public_url(server, monkeypatch):
+    workers = worker_urls(2, "0.0.0.0", 5000, "https://play.example.com:{port}")
+    monkeypatch.setattr(server, "SHARDS", ShardMap(workers, workers[0]))
+    game_id = next(i for i in range(100) if not server.SHARDS.is_local(i))
+
+    async def get():
+        async with server.app.test_app() as app:
+            client = await logged_in(app, "shard_player")
+            return await client.get(f"/play/{game_id}/")
+
+    response = asyncio.run(get())
+    assert response.status_code == 302
+    assert response.location == f"https://play.example.com:5001/play/{game_id}/"
+
+
+def test_websocket_latency_during_profile_uploads(server, monkeypatch):
+    data = picture()
+    set_profile = storage.Users.set_profile
+    stall = 0.2  # seconds each save takes, as if the database were locked
+    saving = saved = 0
+
+    def slow_set_profile(self, *args):
+        sleep(stall)
+        return set_profile(self, *args)
+
+    async def counted(*args):
+        nonlocal saving, saved
+        saving += 1
+        await save(*args)
+        saved += 1
+
+    monkeypatch.setattr(storage.Users, "set_profile", slow_set_profile)
+    save = server.USERS.set_profile
+    monkeypatch.setattr(server.USERS, "set_profile", counted)
+
+    async def upload(client):
+        response = await client.post(
+            "/profile/me/",
+            files={
+                "profile-picture": FileStorage(
+                    BytesIO(data), filename="noise.png", content_type="image/png"
+                )
+            },
+        )
+        assert response.status_code == 302  # not an error page
+
+    async def run():
+        async with server.app.test_app() as app:
+            player = await logged_in(app, "latency_player")
+            uploader = await logged_in(app, "latency_uploader")
+            await player.get("/play/31337/")
+            async with player.websocket("/play/31337/ws") as ws:
+                await round_trips(ws, 2)  # warm up
+                uploads = asyncio.gather(*(upload(uploader) for _ in range(8)))
+                while saving < 8:  # past reading the uploads, which is on the loop
+                    await asyncio.sleep(0.001)
+                busy = await round_trips(ws, 10)
+                overlapped = saved < 8
+                await uploads
+        return busy, overlapped
+
+    busy, overlapped = asyncio.run(run())
+    assert overlapped  # the moves were made while pictures were being saved
+    # had a save held up the event loop, a move would have waited it out
+    assert max(busy) < stall / 2
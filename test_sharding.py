@@ -0,0 +1,85 @@
+import pytest
+
+from sharding import ShardMap, worker_urls
+from storage import ConnectionPool, LiveGames
+
+WORKERS = worker_urls(3, "0.0.0.0", 5000, "https://play.example.com/w{index}/")
+
+
+@pytest.fixture
+def registry(tmp_path):
+    # stands in for the database every worker shares
+    pool = ConnectionPool(str(tmp_path / "live_games.sqlite3"))
+    yield LiveGames(pool)
+    pool.close()
+
+
+def test_worker_urls():
+    assert WORKERS == [
+        "https://play.example.com/w0/",
+        "https://play.example.com/w1/",
+        "https://play.example.com/w2/",
+    ]
+    assert worker_urls(2, "127.0.0.1", 6000) == [
+        "http://127.0.0.1:6000",
+        "http://127.0.0.1:6001",
+    ]
+    assert worker_urls(1, "0.0.0.0", 80, "http://game.example:{port}") == [
+        "http://game.example:80"
+    ]
+
+
+def test_worker_urls_need_a_public_url_on_every_interface():
+    with pytest.raises(ValueError):
+        worker_urls(2, "0.0.0.0")
+
+
+def test_workers_agree_on_one_owner():
+    shards = [ShardMap(WORKERS, me) for me in WORKERS]
+    for game_id in range(300):
+        owners = {shard.owner(game_id) for shard in shards}
+        assert len(owners) == 1
+        assert sum(shard.is_local(game_id) for shard in shards) == 1
+    # every worker gets a share
+    assert {shards[0].owner(game_id) for game_id in range(300)} == set(WORKERS)
+
+
+def test_removing_a_worker_only_moves_its_games():
+    before = ShardMap(WORKERS, WORKERS[0])
+    after = ShardMap(WORKERS[:2], WORKERS[0])
+    for game_id in range(300):
+        if before.owner(game_id) != WORKERS[2]:
+            assert after.owner(game_id) == before.owner(game_id)
+
+
+def test_urls_keep_the_public_path_prefix():
+    shards = ShardMap(WORKERS, WORKERS[0])
+    game_id = next(i for i in range(100) if shards.owner(i) == WORKERS[1])
+    assert shards.url(game_id, f"/play/{game_id}/") == (
+        f"https://play.example.com/w1/play/{game_id}/"
+    )
+
+
+def test_unsharded_owns_everything():
+    shards = ShardMap()
+    assert not shards.sharded
+    assert shards.is_local(12345)
+
+
+def test_unknown_worker():
+    with pytest.raises(ValueError):
+        ShardMap(WORKERS, "http://127.0.0.1:5000")
+
+
+def test_workers_share_the_live_games_registry(registry):
+    shards = [ShardMap(WORKERS, me) for me in WORKERS]
+    for game_id in range(30):
+        for shard in shards:
+            if shard.is_local(game_id):
+                registry.add(game_id, shard.me)
+    assert registry.game_ids() == list(range(30))
+
+    registry.remove_worker(WORKERS[1])  # as it does before restoring its games
+    assert registry.game_ids() == [
+        game_id for game_id in range(30) if shards[0].owner(game_id) != WORKERS[1]
+    ]
@@ -0,0 +1,35 @@
+import pytest
+
+import storage
+from storage import MIGRATIONS, ConnectionPool, CursorManager, GameEvents
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "resistance.sqlite3"))
+    yield pool
+    pool.close()
+
+
+def test_unfinished_game_runs(pool):
+    events = GameEvents(pool)
+    events.append([("a", 1, "join", "{}"), ("b", 2, "join", "{}")])
+    events.append([("c", 1, "join", "{}"), ("b", 2, "end", "{}")])
+    events.append([("d", 3, "join", "{}"), ("d", 3, "abort", "{}")])
+    assert events.unfinished() == [("a", 1), ("c", 1)]
+    assert events.events("b") == [("join", {}), ("end", {})]
+
+
+def test_unfinished_game_runs_from_before_game_runs(pool, monkeypatch):
+    version = next(
+        i for i, migration in enumerate(MIGRATIONS) if "game_runs" in str(migration)
+    )
+    with monkeypatch.context() as patch:
+        patch.setattr(storage, "MIGRATIONS", MIGRATIONS[:version])
+        storage.migrate(pool)
+    with CursorManager(pool) as cursor:
+        cursor.executemany(
+            "INSERT INTO game_events VALUES (?, ?, ?, '{}')",
+            [("a", 1, "join"), ("b", 2, "join"), ("b", 2, "end"), ("c", 1, "join")],
+        )
+    assert GameEvents(pool).unfinished() == [("a", 1), ("c", 1)]
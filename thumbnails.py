@@ -0,0 +1,40 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+SIZES = (100, 200)  # bounding box edge lengths, in pixels
+MIMETYPE = "image/webp"
+
+
+class InvalidImage(ValueError):
+    """Raised when uploaded data cannot be decoded as an image."""
+
+
+def make_renditions(data, sizes=SIZES):
+    """
+    Make smaller copies of an uploaded image.
+
+    Returns a dict mapping each size to WebP bytes that fit in a size-by-size
+    box. Animated images keep only their first frame, and EXIF and other
+    metadata are dropped. Raises `InvalidImage` if the data can't be decoded.
+    """
+    try:
+        return _make_renditions(data, sizes)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise InvalidImage(str(error)) from error
+
+
+def _make_renditions(data, sizes):
+    with Image.open(BytesIO(data)) as image:
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)  # apply orientation before stripping
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        renditions = dict()
+        for size in sizes:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            output = BytesIO()
+            thumbnail.save(output, format="WEBP", quality=80)
+            renditions[size] = output.getvalue()
+        return renditions